@@ -1,8 +1,16 @@
 import logging
 
-from .servicex_databinder import DataBinder # NOQA
-
 __version__ = '0.5.0'
+__all__ = ['DataBinder']
+
+
+def __getattr__(name):
+    # DataBinder and its dependencies are imported on first use
+    if name == 'DataBinder':
+        from .servicex_databinder import DataBinder
+        return DataBinder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 logging.basicConfig(format="%(levelname)s - %(message)s")
 logging.getLogger(__name__).setLevel(logging.INFO)
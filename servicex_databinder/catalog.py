@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+import json
+import os
+
+import yaml
+
+import logging
+log = logging.getLogger(__name__)
+
+FORMATS = {'yaml': '.yml', 'json': '.json'}
+
+
+class OutputCatalog():
+    """
+    Delivered file paths per (Sample, Tree) - tree is None for Samples
+    without Tree. Paths are kept in the order they are added, without
+    duplicates, and adding paths does not rebuild the existing ones.
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        # (sample, tree) -> insertion-ordered set of paths
+        self._paths = {}
+        # path -> file metadata
+        self.metadata = {}
+        self._samples = {}
+        for sample in config['Sample']:
+            trees = self._samples.setdefault(sample['Name'], [])
+            if 'Tree' in sample.keys():
+                for tree in sample['Tree'].split(','):
+                    if tree.strip() not in trees:
+                        trees.append(tree.strip())
+        for sample, trees in self._samples.items():
+            for tree in trees or [None]:
+                self._paths[(sample, tree)] = {}
+
+    def add(self, sample: str, tree: Union[str, None],
+            paths: Iterable[str]):
+        entry = self._paths.setdefault((sample, tree), {})
+        for path in paths:
+            entry[str(path)] = None
+
+    def replace(self, sample: str, tree: Union[str, None],
+                paths: Iterable[str]):
+        self._paths[(sample, tree)] = dict.fromkeys(str(p) for p in paths)
+
+    def add_metadata(self, metadata: Dict[str, Dict[str, Any]]):
+        self.metadata.update(metadata)
+
+    def paths(self, sample: str, tree: str = None) -> List[str]:
+        return list(self._paths.get((sample, tree), {}))
+
+    def __iter__(self) -> Iterator[Tuple[str, Union[str, None], List[str]]]:
+        for (sample, tree), paths in self._paths.items():
+            yield sample, tree, list(paths)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Nested dictionary Sample -> Tree -> paths, or Sample -> paths
+        for Samples without Tree
+        """
+        out = {}
+        for sample, trees in self._samples.items():
+            if trees:
+                out[sample] = {tree: list(self._paths[(sample, tree)])
+                               for tree in trees}
+            else:
+                out[sample] = list(self._paths[(sample, None)])
+        return out
+
+    def write(self, path: Union[str, Path], fmt: str = 'yaml') -> Path:
+        """
+        Write the nested dictionary to path with the suffix of the format
+        (yaml or json)
+        """
+        path = Path(path).with_suffix(FORMATS[fmt])
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, 'w') as f:
+            if fmt == 'json':
+                json.dump(self.as_dict(), f, separators=(',', ':'))
+            else:
+                yaml.dump(self.as_dict(), f, default_flow_style=False,
+                          Dumper=getattr(yaml, 'CSafeDumper',
+                                         yaml.SafeDumper))
+        os.replace(tmp, path)
+        return path
+
+    def write_metadata(self, path: Union[str, Path]) -> Path:
+        """
+        Write path -> metadata of the files in the catalog as JSON
+        """
+        path = Path(path)
+        metadata = {p: self.metadata[p] for _, _, paths in self
+                    for p in paths if p in self.metadata}
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(metadata, separators=(',', ':')))
+        os.replace(tmp, path)
+        return path
+
+
+def load_file_metadata(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Read file metadata written next to the output dictionary
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_output_dict(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Read an output dictionary written by DataBinder (yaml or json)
+    """
+    path = Path(path)
+    with open(path) as f:
+        if path.suffix == '.json':
+            return json.load(f)
+        return yaml.load(f, Loader=getattr(yaml, 'CSafeLoader',
+                                           yaml.SafeLoader))
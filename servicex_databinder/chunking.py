@@ -0,0 +1,61 @@
+from typing import Any, Dict, Iterable, List, Tuple, Union
+import math
+
+import logging
+log = logging.getLogger(__name__)
+
+# boundaries are snapped to row groups closer than this fraction of a step
+SNAP_TOLERANCE = 0.15
+
+
+def plan_steps(num_rows: int, chunk_size: int,
+               entry_offsets: List[int] = None) -> List[List[int]]:
+    """
+    Split num_rows entries into [start, stop) steps of about chunk_size
+    entries and of balanced size. Boundaries are moved to the closest
+    row group or cluster boundary in entry_offsets if it is within
+    SNAP_TOLERANCE of a step, otherwise they stay inside the row group.
+    """
+    if num_rows <= 0:
+        return []
+    n_chunks = math.ceil(num_rows / chunk_size)
+    boundaries = [round(i * num_rows / n_chunks) for i in range(n_chunks + 1)]
+    if entry_offsets is not None and len(entry_offsets) > 2:
+        offsets = sorted(set(entry_offsets) | {0, num_rows})
+        tolerance = SNAP_TOLERANCE * num_rows / n_chunks
+        snapped = set()
+        for b in boundaries:
+            closest = min(offsets, key=lambda o: abs(o - b))
+            snapped.add(closest if abs(closest - b) <= tolerance else b)
+        boundaries = sorted(snapped)
+    return [[start, stop] for start, stop
+            in zip(boundaries[:-1], boundaries[1:])]
+
+
+def chunk_plan(files: Iterable[Tuple[str, Union[str, None], List[str]]],
+               metadata: Dict[str, Dict[str, Any]],
+               chunk_size: int) -> Dict[str, Any]:
+    """
+    Chunk plan in the layout of a preprocessed coffea fileset:
+    dataset ("Sample" or "Sample/Tree") -> files -> path ->
+    object_path, num_entries and steps. Files without num_rows in
+    the metadata are left out.
+    """
+    plan = {}
+    for sample, tree, paths in files:
+        dataset = sample if tree is None else f"{sample}/{tree}"
+        entries = {}
+        for path in paths:
+            meta = metadata.get(path) or {}
+            if 'num_rows' not in meta:
+                log.debug(f"No number of entries of {path} - "
+                          "not in the chunk plan")
+                continue
+            entries[path] = {
+                'object_path': meta.get('tree', tree),
+                'num_entries': meta['num_rows'],
+                'steps': plan_steps(meta['num_rows'], chunk_size,
+                                    meta.get('entry_offsets')),
+                }
+        plan[dataset] = {'files': entries}
+    return plan
@@ -0,0 +1,125 @@
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+import re
+
+import logging
+log = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+_UNITS = {'': 1e6, 'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9, 'TB': 1e12}
+
+
+def parse_size(size: Union[int, float, str]) -> int:
+    """
+    Size in bytes from a number of MB or a string like "1GB" or "500 MB"
+    """
+    if isinstance(size, (int, float)) and not isinstance(size, bool):
+        return int(size * _UNITS['MB'])
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?B?)\s*", str(size).upper())
+    if match is None:
+        raise ValueError(f"Cannot parse size {size}")
+    value, unit = match.groups()
+    if unit and not unit.endswith('B'):
+        unit += 'B'
+    return int(float(value) * _UNITS[unit])
+
+
+def plan_merges(files: List[Tuple[str, int]],
+                target_size: int) -> List[List[str]]:
+    """
+    Group (path, size) in order into groups of up to target_size bytes.
+    A file larger than target_size makes a group by itself.
+    """
+    groups, group, group_size = [], [], 0
+    for path, size in files:
+        if group and group_size + size > target_size:
+            groups.append(group)
+            group, group_size = [], 0
+        group.append(path)
+        group_size += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def merge_parquet(sources: List[PathLike], target: PathLike) -> int:
+    """
+    Merge parquet files by streaming their row groups into one file.
+    Returns the number of rows written.
+    """
+    import pyarrow.parquet as pq
+
+    writer = None
+    nrows = 0
+    try:
+        for source in sources:
+            pf = pq.ParquetFile(source)
+            if writer is None:
+                # keep the codec of the delivered files
+                codec = 'snappy'
+                if pf.metadata.num_row_groups:
+                    codec = pf.metadata.row_group(0).column(0)\
+                        .compression.lower()
+                writer = pq.ParquetWriter(
+                    target, pf.schema_arrow,
+                    compression='none' if codec == 'uncompressed' else codec
+                    )
+            for i in range(pf.metadata.num_row_groups):
+                table = pf.read_row_group(i)
+                writer.write_table(table.cast(writer.schema))
+                nrows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return nrows
+
+
+def merge_root(tree_name: Union[str, None], sources: List[PathLike],
+               target: PathLike, step_size: str = "100 MB") -> int:
+    """
+    Merge TTrees of ROOT files by streaming their entries into one file.
+    The first TTree of the first file is used if tree_name is None.
+    Returns the number of entries written.
+    """
+    import uproot
+
+    nentries = 0
+    with uproot.recreate(target) as outfile:
+        tree = None
+        for source in sources:
+            with uproot.open(source) as infile:
+                name = tree_name
+                if name is None or name not in infile:
+                    trees = infile.keys(filter_classname="TTree",
+                                        cycle=False)
+                    if not trees:
+                        continue
+                    name = trees[0]
+                intree = infile[name]
+                counters = {
+                    branch.count_branch.name for branch in intree.values()
+                    if getattr(branch, 'count_branch', None) is not None}
+                for arr in intree.iterate(
+                        step_size=step_size,
+                        filter_branch=lambda b: b.name not in counters):
+                    branches = {field: arr[field] for field in arr.fields}
+                    if tree is None:
+                        tree = outfile.mktree(
+                            name,
+                            {field: branch.type.content
+                             for field, branch in branches.items()}
+                            )
+                    tree.extend(branches)
+                    nentries += len(arr)
+    return nentries
+
+
+def merge_files(job: Dict[str, Any]) -> int:
+    """
+    Merge one group of files - top-level so that it can run on a
+    process pool. job: sources, target, tree
+    """
+    if Path(job['target']).suffix == '.parquet':
+        return merge_parquet(job['sources'], job['target'])
+    return merge_root(job['tree'], job['sources'], job['target'])
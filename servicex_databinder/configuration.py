@@ -1,6 +1,6 @@
-from servicex import servicex_config
 import yaml
 import pathlib
+import re
 from typing import Any, Dict, Union
 import logging
 log = logging.getLogger(__name__)
@@ -38,33 +38,49 @@ def LoadConfig(input_config:
 
 
 def _replace_definition_in_sample_block(config: Dict[str, Any]):
+    """
+    Replace Definition placeholders in string options of all Samples
+    in a single pass of one regex over all placeholders
+    """
+    definitions = config.get('Definition')
+    if not definitions:
+        return False
+    # longest placeholder first so that DEF_ab wins over DEF_a
+    pattern = re.compile("|".join(
+        re.escape(repre)
+        for repre in sorted(definitions, key=len, reverse=True)))
+
+    def replace(match):
+        return str(definitions[match.group(0)])
+
     flag = False
-    if config.get('Definition'):
-        for n, sample in enumerate(config.get('Sample')):
-            for field, value in sample.items():
-                if 'DEF_' in value:
-                    for repre, new_str in config.get('Definition').items():
-                        if repre in value:
-                            log.debug(
-                                f"Replace Definition for {sample['Name']} "
-                                f"- {field}: {repre} with {new_str}")
-                            config.get('Sample')[n][field] \
-                                = config.get('Sample')[n][field] \
-                                        .replace(repre, new_str)
-                            flag = True
-        return flag
-    else:
-        return flag
+    for sample in config.get('Sample'):
+        for field, value in sample.items():
+            if isinstance(value, str) and 'DEF_' in value:
+                new_value = pattern.sub(replace, value)
+                if new_value != value:
+                    log.debug(f"Replace Definition for {sample['Name']} "
+                              f"- {field}: {new_value}")
+                    sample[field] = new_value
+                    flag = True
+    return flag
 
 
 def _update_backend_per_sample(config: Dict[str, Any]) -> Dict:
-    """ from servicex.yaml file """
-    backend_type = servicex_config.ServiceXConfigAdaptor()\
-        .get_backend_info(config['General']['ServiceXName'], "type")
-    if backend_type == "xaod":
-        pair = ("xaod", "atlasr21")
-    elif backend_type == "uproot":
-        pair = ("uproot", "uproot")
+    """ from servicex.yaml file - only if a Sample relies on it """
+    pair = ("uproot", "uproot")
+    if 'Transformer' not in config['General'].keys() and any(
+            'Transformer' not in sample.keys()
+            and 'LocalPath' not in sample.keys()
+            for sample in config['Sample']):
+        from servicex import servicex_config
+        from .dispatcher import primary_backend
+        backend_type = servicex_config.ServiceXConfigAdaptor()\
+            .get_backend_info(primary_backend(config), "type")
+        if backend_type == "xaod":
+            pair = ("xaod", "atlasr21")
+        elif backend_type == "uproot":
+            pair = ("uproot", "uproot")
 
     """ from General block """
     if 'Transformer' in config['General'].keys():
@@ -96,6 +112,10 @@ def _decorate_defaults(config: Dict[str, Any]) -> Dict:
         config['General']['Delivery'] = config['General']['Delivery'].lower()
     else:
         config['General']['Delivery'] = 'localpath'
+    if 'MaxConcurrentRequests' not in config['General'].keys():
+        config['General']['MaxConcurrentRequests'] = 50
+    if 'CopyWorkers' not in config['General'].keys():
+        config['General']['CopyWorkers'] = 8
     return config
 
 
@@ -122,7 +142,13 @@ def _validate_config(config: Dict[str, Any]) -> bool:
         'IgnoreLocalCache', 'Sample', 'RucioDID', 'XRootDFiles', 'Tree',
         'Filter', 'Columns', 'FuncADL', 'LocalPath', 'Definition',
         'ServiceXBackendName', 'IgnoreServiceXCache',
-        'Delivery', 'Function'
+        'Delivery', 'Function', 'MaxConcurrentRequests', 'CopyWorkers',
+        'ResultCacheTTL', 'ConvertMaxMemory', 'ConvertWorkers',
+        'ConvertTo', 'ConvertCompression', 'ConvertRowGroupSize',
+        'MergeTargetSize', 'Retry', 'SchedulePolicy', 'Priority',
+        'LoadBalancing', 'MaxFilesPerRequest', 'QueryCache',
+        'PipelineRequests', 'OutputDictFormat', 'FileMetadata',
+        'ChunkSize', 'Checksum', 'RucioFileCounts'
         ]
 
     if 'General' not in config.keys() and 'Sample' not in config.keys():
@@ -143,22 +169,85 @@ def _validate_config(config: Dict[str, Any]) -> bool:
     # Check General block option values
     if 'Delivery' in config['General'].keys():
         if config['General']['Delivery'] not in [
-                'localpath', 'localcache', 'objectstore']:
+                'localpath', 'locallink', 'localcache', 'objectstore']:
             raise ValueError(
                 f"Unsupported delivery option: {config['General']['Delivery']}"
-                f" - supported options: LocalPath, LocalCache, ObjectStore"
+                " - supported options: LocalPath, LocalLink, LocalCache,"
+                " ObjectStore"
                 )
 
+    for option in ['MaxConcurrentRequests', 'CopyWorkers', 'ConvertWorkers',
+                   'ConvertMaxMemory', 'ConvertRowGroupSize', 'ChunkSize']:
+        if option in config['General'].keys():
+            if not isinstance(config['General'][option], int) \
+                    or config['General'][option] < 1:
+                raise ValueError(f"{option} should be a positive integer")
+
+    if 'ResultCacheTTL' in config['General'].keys():
+        ttl = config['General']['ResultCacheTTL']
+        if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) \
+                or ttl < 0:
+            raise ValueError("ResultCacheTTL should be a non-negative number "
+                             "of seconds")
+
+    if 'SchedulePolicy' in config['General'].keys():
+        from .scheduler import POLICIES
+        if str(config['General']['SchedulePolicy']).lower() not in POLICIES:
+            raise ValueError(
+                "Unsupported SchedulePolicy "
+                f"{config['General']['SchedulePolicy']} - supported "
+                f"policies: {', '.join(POLICIES)}"
+                )
+
+    if 'QueryCache' in config['General'].keys():
+        if not isinstance(config['General']['QueryCache'], (bool, str)):
+            raise ValueError("QueryCache should be True, False or "
+                             "a directory")
+
+    if 'OutputDictFormat' in config['General'].keys():
+        from .catalog import FORMATS
+        formats = config['General']['OutputDictFormat']
+        formats = [str(fmt).lower() for fmt in
+                   (formats if isinstance(formats, list) else [formats])]
+        if not formats or any(fmt not in FORMATS for fmt in formats):
+            raise ValueError(
+                "OutputDictFormat should be one or a list of "
+                f"{', '.join(FORMATS)}"
+                )
+        config['General']['OutputDictFormat'] = formats
+
+    if 'Checksum' in config['General'].keys():
+        _validate_checksum(config['General'])
+
+    if 'Retry' in config['General'].keys():
+        _validate_retry(config['General']['Retry'])
+
     if ('ServiceXName' not in config['General'].keys()) and \
             ('ServiceXBackendName' not in config['General'].keys()):
         raise KeyError("Option 'ServiceXName' is required in General block")
 
+    if isinstance(config['General'].get('ServiceXName'), list) \
+            or 'LoadBalancing' in config['General'].keys():
+        _validate_backends(config['General'])
+
     if 'OutputFormat' not in config['General'].keys():
         raise KeyError("OutputFormat is required")
     elif config['General']['OutputFormat'].lower() != 'parquet' and \
             config['General']['OutputFormat'].lower() != 'root':
         raise ValueError("OutputFormat can be either parquet or root")
 
+    if 'ConvertTo' in config['General'].keys():
+        _validate_conversion(config['General'])
+
+    if 'MergeTargetSize' in config['General'].keys():
+        from .compaction import parse_size
+        if parse_size(config['General']['MergeTargetSize']) <= 0:
+            raise ValueError("MergeTargetSize should be a positive size")
+        if config['General'].get('Delivery', 'localpath') \
+                not in ['localpath', 'locallink']:
+            raise ValueError("MergeTargetSize is only available for "
+                             "LocalPath and LocalLink delivery")
+
     for sample in config['Sample']:
         if ('RucioDID' not in sample.keys()) \
                 and ('XRootDFiles' not in sample.keys()) \
@@ -180,6 +269,20 @@ def _validate_config(config: Dict[str, Any]) -> bool:
         #         f"Tree in Sample {sample['Name']} "
         #         "is only for uproot backend type"
         #         )
+        if 'MaxFilesPerRequest' in sample.keys():
+            if isinstance(sample['MaxFilesPerRequest'], bool) \
+                    or not isinstance(sample['MaxFilesPerRequest'], int) \
+                    or sample['MaxFilesPerRequest'] < 1:
+                raise ValueError(
+                    f"Sample {sample['Name']} - MaxFilesPerRequest "
+                    "should be a positive integer"
+                    )
+        if 'Priority' in sample.keys():
+            if isinstance(sample['Priority'], bool) \
+                    or not isinstance(sample['Priority'], (int, float)):
+                raise ValueError(
+                    f"Sample {sample['Name']} - Priority should be a number"
+                    )
         if 'Columns' in sample and 'FuncADL' in sample:
             raise KeyError(
                 f"Sample {sample['Name']} - Use one type of query per sample: "
@@ -193,3 +296,90 @@ def _validate_config(config: Dict[str, Any]) -> bool:
 
     log.debug("config looks okay")
     return True
+
+
+def _validate_conversion(general: Dict[str, Any]):
+    from .converter import ROOT_CODECS, PARQUET_CODECS, parse_compression
+
+    convert_to = str(general['ConvertTo']).lower()
+    if convert_to not in ['root', 'parquet']:
+        raise ValueError("ConvertTo can be either parquet or root")
+    if convert_to == str(general['OutputFormat']).lower():
+        raise ValueError("ConvertTo should be different from OutputFormat")
+    if general.get('Delivery', 'localpath') \
+            not in ['localpath', 'locallink']:
+        raise ValueError("ConvertTo is only available for LocalPath "
+                         "and LocalLink delivery")
+    general['ConvertTo'] = convert_to
+
+    codec, _ = parse_compression(general.get('ConvertCompression'))
+    codecs = ROOT_CODECS if convert_to == 'root' else PARQUET_CODECS
+    if codec is not None and codec not in codecs:
+        raise ValueError(
+            f"Unsupported ConvertCompression {codec} for {convert_to} "
+            f"- supported codecs: {', '.join(codecs)}"
+            )
+
+
+def _validate_retry(retry: Union[bool, Dict[str, Any]]):
+    if retry is False or retry is None:
+        return
+    if not isinstance(retry, dict):
+        raise ValueError("Retry should be False or a mapping of error class "
+                         "names to retry policies")
+    for error, policy in retry.items():
+        policy = policy or {}
+        for key, value in policy.items():
+            if key not in ['MaxAttempts', 'Backoff', 'MaxBackoff']:
+                raise KeyError(f"Unknown Retry option {key} for {error}")
+            if isinstance(value, bool) \
+                    or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"Retry {key} for {error} should be "
+                                 "a non-negative number")
+        if not isinstance(policy.get('MaxAttempts', 1), int) \
+                or policy.get('MaxAttempts', 1) < 1:
+            raise ValueError(f"Retry MaxAttempts for {error} should be "
+                             "a positive integer")
+
+
+def _validate_backends(general: Dict[str, Any]):
+    from .dispatcher import POLICIES
+
+    backends = general.get('ServiceXName')
+    if not isinstance(backends, list):
+        backends = [backends]
+    if not backends:
+        raise ValueError("ServiceXName should have at least one backend")
+    for backend in backends:
+        if isinstance(backend, dict):
+            if 'Name' not in backend:
+                raise KeyError("Each backend in ServiceXName needs a Name")
+            weight = backend.get('Weight', 1)
+            if isinstance(weight, bool) \
+                    or not isinstance(weight, (int, float)) or weight <= 0:
+                raise ValueError(f"Weight of backend {backend['Name']} "
+                                 "should be a positive number")
+        elif not isinstance(backend, str):
+            raise ValueError("ServiceXName should be a backend name or "
+                             "a list of backend names")
+    if str(general.get('LoadBalancing', POLICIES[0])).lower() \
+            not in POLICIES:
+        raise ValueError(
+            f"Unsupported LoadBalancing {general['LoadBalancing']} "
+            f"- supported policies: {', '.join(POLICIES)}"
+            )
+
+
+def _validate_checksum(general: Dict[str, Any]):
+    from .integrity import ALGORITHMS
+    algorithm = general['Checksum']
+    if algorithm is False:
+        return
+    if str(algorithm).lower() not in ALGORITHMS:
+        raise ValueError(f"Checksum can be one of {', '.join(ALGORITHMS)}")
+    general['Checksum'] = str(algorithm).lower()
+    if general['Checksum'] == 'xxh64':
+        try:
+            import xxhash  # noqa: F401
+        except ImportError:
+            raise ImportError("Checksum xxh64 requires the xxhash package")
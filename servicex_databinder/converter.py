@@ -0,0 +1,207 @@
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import logging
+log = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+# default memory cap (in MB) of one conversion
+DEFAULT_MAX_MEMORY = 512
+# compression codecs and their default levels
+ROOT_CODECS = {'zlib': 1, 'lzma': 9, 'lz4': 4, 'zstd': 5}
+PARQUET_CODECS = {'snappy': None, 'gzip': None, 'brotli': None,
+                  'lz4': None, 'zstd': None}
+SUFFIXES = {'root': '.root', 'parquet': '.parquet'}
+# read buffer of streamed parquet files
+READ_BUFFER_SIZE = 1 << 20
+
+
+def parse_compression(compression: Union[str, None]) -> Tuple[str, int]:
+    """
+    Split a compression setting "codec" or "codec:level"
+    """
+    if compression is None or str(compression).lower() == 'none':
+        return None, None
+    codec, _, level = str(compression).lower().partition(':')
+    return codec, int(level) if level else None
+
+
+def _root_compression(compression: Union[str, None]):
+    import uproot
+    codec, level = parse_compression(compression)
+    if codec is None:
+        return None
+    cls = {'zlib': uproot.ZLIB, 'lzma': uproot.LZMA,
+           'lz4': uproot.LZ4, 'zstd': uproot.ZSTD}[codec]
+    return cls(level if level is not None else ROOT_CODECS[codec])
+
+
+def _non_nullable(arrow_type):
+    """
+    Same arrow type with non-nullable children, so that awkward arrays
+    come without option types which cannot be written to a TTree
+    """
+    import pyarrow as pa
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        field = arrow_type.value_field
+        value = pa.field(field.name, _non_nullable(field.type), nullable=False)
+        if pa.types.is_list(arrow_type):
+            return pa.list_(value)
+        return pa.large_list(value)
+    if pa.types.is_struct(arrow_type):
+        return pa.struct([
+            pa.field(f.name, _non_nullable(f.type), nullable=False)
+            for f in arrow_type])
+    return arrow_type
+
+
+def _rows_per_batch(metadata, max_memory: float) -> int:
+    """
+    Number of rows to hold in memory so that one batch stays below
+    max_memory MB, estimated from the uncompressed row group sizes
+    """
+    nbytes = sum(metadata.row_group(i).total_byte_size
+                 for i in range(metadata.num_row_groups))
+    bytes_per_row = max(nbytes / max(metadata.num_rows, 1), 1.)
+    return max(int(max_memory * 1e6 / bytes_per_row), 1)
+
+
+def _open_parquet(path: PathLike):
+    """
+    ParquetFile read page by page through a small buffer - otherwise
+    a batch decodes its whole row group, whatever the batch size
+    """
+    import pyarrow.parquet as pq
+    try:
+        return pq.ParquetFile(path, buffer_size=READ_BUFFER_SIZE,
+                              pre_buffer=False)
+    except TypeError:
+        # pyarrow without pre_buffer does not pre-buffer
+        return pq.ParquetFile(path, buffer_size=READ_BUFFER_SIZE)
+
+
+def parquet_to_root(tree_name: str, pq_file: PathLike, root_file: PathLike,
+                    max_memory: float = DEFAULT_MAX_MEMORY,
+                    compression: str = None,
+                    row_group_size: int = None) -> bool:
+    """
+    Write ROOT ntuple from parquet file, streaming record batches of
+    at most max_memory MB (and row_group_size entries) into TTree baskets.
+    Returns False if the parquet file has no entries.
+    """
+    import awkward as ak
+    import uproot
+
+    pf = _open_parquet(pq_file)
+    if pf.metadata.num_rows == 0:
+        return False
+
+    import pyarrow as pa
+    schema = pa.schema([
+        pa.field(f.name, _non_nullable(f.type), nullable=False)
+        for f in pf.schema_arrow])
+
+    batch_size = _rows_per_batch(pf.metadata, max_memory)
+    if row_group_size:
+        batch_size = min(batch_size, row_group_size)
+    kwargs = {}
+    if compression is not None:
+        kwargs['compression'] = _root_compression(compression)
+    with uproot.recreate(root_file, **kwargs) as outfile:
+        tree = None
+        for batch in pf.iter_batches(batch_size=batch_size):
+            ak_arr = ak.from_arrow(batch.cast(schema))
+            tree_dict = {field: ak_arr[field] for field in ak_arr.fields}
+            if tree is None:
+                tree = outfile.mktree(
+                    tree_name,
+                    {field: arr.type.content
+                     for field, arr in tree_dict.items()}
+                    )
+            tree.extend(tree_dict)
+    return True
+
+
+def root_to_parquet(tree_name: Union[str, None], root_file: PathLike,
+                    pq_file: PathLike,
+                    max_memory: float = DEFAULT_MAX_MEMORY,
+                    compression: str = None,
+                    row_group_size: int = None) -> bool:
+    """
+    Write parquet file from a ROOT ntuple, iterating the TTree in steps
+    of at most max_memory MB. The first TTree in the file is used if
+    tree_name is None or not in the file.
+    Returns False if the TTree has no entries.
+    """
+    import pyarrow.parquet as pq
+    import awkward as ak
+    import uproot
+
+    with uproot.open(root_file) as infile:
+        if tree_name is None or tree_name not in infile:
+            trees = infile.keys(filter_classname="TTree", cycle=False)
+            if not trees:
+                return False
+            tree_name = trees[0]
+        tree = infile[tree_name]
+        if tree.num_entries == 0:
+            return False
+
+        # counter branches of jagged branches are not columns
+        counters = {branch.count_branch.name for branch in tree.values()
+                    if getattr(branch, 'count_branch', None) is not None}
+        codec, level = parse_compression(compression)
+        writer = None
+        try:
+            for arr in tree.iterate(
+                    step_size=f"{max_memory} MB",
+                    filter_branch=lambda b: b.name not in counters):
+                table = ak.to_arrow_table(arr)
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        pq_file, table.schema,
+                        compression=codec or 'none',
+                        compression_level=level
+                        )
+                writer.write_table(table, row_group_size=row_group_size)
+        finally:
+            if writer is not None:
+                writer.close()
+    return True
+
+
+def convert_file(job: Dict[str, Any]) -> bool:
+    """
+    Convert one file - top-level so that it can run on a process pool.
+    job: source, target, to ('root' or 'parquet'), tree, max_memory,
+    compression, row_group_size
+    """
+    convert = parquet_to_root if job['to'] == 'root' else root_to_parquet
+    return convert(
+        job['tree'], str(job['source']), str(job['target']),
+        job.get('max_memory', DEFAULT_MAX_MEMORY),
+        job.get('compression'), job.get('row_group_size')
+        )
+
+
+def _parquet_to_root_job(job: Tuple[str, str, str, float]) -> bool:
+    return parquet_to_root(*job)
+
+
+def bulk_parquet_to_root(jobs: List[Tuple[str, PathLike, PathLike]],
+                         max_memory: float = DEFAULT_MAX_MEMORY,
+                         workers: int = None) -> List[bool]:
+    """
+    Convert (tree name, parquet file, ROOT file) jobs in parallel on a
+    process pool. Each worker keeps at most max_memory MB in flight.
+    """
+    workers = workers or os.cpu_count() or 1
+    args = [(tree, str(pq_file), str(root_file), max_memory)
+            for tree, pq_file, root_file in jobs]
+    if len(args) <= 1 or workers == 1:
+        return [_parquet_to_root_job(arg) for arg in args]
+    with ProcessPoolExecutor(max_workers=min(workers, len(args))) as pool:
+        return list(pool.map(_parquet_to_root_job, args))
@@ -0,0 +1,186 @@
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import errno
+import os
+import shutil
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+# ioctl request number of FICLONE (Linux) to create a reflink
+_FICLONE = 0x40049409
+# errors meaning "this fast path is not available here, try the next one"
+_FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+    errno.ENOTSUP, errno.ENOTTY, errno.EBADF, errno.EPERM
+    }
+
+
+def _reflink(fsrc, fdst) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_file_range(fsrc, fdst, size: int) -> bool:
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                      size - offset, offset, offset)
+            if sent == 0:
+                break
+            offset += sent
+    except OSError as e:
+        if e.errno in _FALLBACK_ERRNOS:
+            return False
+        raise
+    return offset == size
+
+
+def _sendfile(fsrc, fdst, size: int) -> bool:
+    if not hasattr(os, 'sendfile'):
+        return False
+    offset = 0
+    try:
+        fdst.seek(0)
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset,
+                               min(size - offset, 1 << 30))
+            if sent == 0:
+                break
+            offset += sent
+    except OSError as e:
+        if e.errno in _FALLBACK_ERRNOS:
+            return False
+        raise
+    return offset == size
+
+
+def copy_file(src: PathLike, dst: PathLike) -> int:
+    """
+    Copy a single file using the fastest method available on the platform:
+    reflink, copy_file_range, sendfile and a plain buffered copy as fallback.
+    Returns the number of bytes copied.
+    """
+    # never write through an existing (hard or symbolic) link into the cache
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        if not (_reflink(fsrc, fdst)
+                or _copy_file_range(fsrc, fdst, size)
+                or _sendfile(fsrc, fdst, size)):
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copymode(src, dst)
+    return size
+
+
+def link_file(src: PathLike, dst: PathLike) -> str:
+    """
+    Link a file without copying data: hard link if src and dst share
+    a filesystem, otherwise a symbolic link. Returns the link type.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return "hard"
+    except OSError:
+        os.symlink(Path(src).resolve(), dst)
+        return "symbolic"
+
+
+class CopyEngine():
+    """
+    Copy files in parallel on a thread pool, off the asyncio event loop
+    """
+
+    def __init__(self, workers: int = 8) -> None:
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="databinder-copy"
+            )
+        self._lock = Lock()
+        self.bytes_copied = 0
+        self.files_copied = 0
+        self.files_linked = 0
+        self._start = None
+        self._end = None
+
+    def copy_files(self, pairs: Iterable[Tuple[PathLike, PathLike]]) -> int:
+        """
+        Copy (source, destination) pairs in parallel and block until
+        all copies are done. Returns the number of bytes copied.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return 0
+        with self._lock:
+            if self._start is None:
+                self._start = time.monotonic()
+        futures = [self._executor.submit(copy_file, src, dst)
+                   for src, dst in pairs]
+        nbytes = sum(f.result() for f in futures)
+        with self._lock:
+            self.bytes_copied += nbytes
+            self.files_copied += len(pairs)
+            self._end = time.monotonic()
+        return nbytes
+
+    def link_files(self, pairs: Iterable[Tuple[PathLike, PathLike]]) -> int:
+        """
+        Link (source, destination) pairs and block until done.
+        Returns 0 as no bytes are copied.
+        """
+        pairs = list(pairs)
+        futures = [self._executor.submit(link_file, src, dst)
+                   for src, dst in pairs]
+        kinds = [f.result() for f in futures]
+        with self._lock:
+            self.files_linked += len(pairs)
+        if "symbolic" in kinds:
+            log.debug(f"{kinds.count('symbolic')} file(s) are symlinked "
+                      "as the ServiceX cache is on another filesystem")
+        return 0
+
+    def map(self, func: Callable[[Any], Any], items: Iterable[Any]
+            ) -> List[Any]:
+        """
+        Apply func to items on the copy threads, e.g. to read files
+        right after they are copied. Blocks until all calls are done.
+        """
+        return list(self._executor.map(func, items))
+
+    @property
+    def throughput(self) -> float:
+        """
+        Copied bytes per second since the first copy
+        """
+        if self._start is None or self._end is None \
+                or self._end <= self._start:
+            return 0.
+        return self.bytes_copied / (self._end - self._start)
+
+    def report(self) -> str:
+        if self.files_linked and not self.files_copied:
+            return f"{self.files_linked} file(s) linked"
+        return (f"{self.files_copied} file(s) copied, "
+                f"{self.bytes_copied / 1e6:.1f} MB "
+                f"at {self.throughput / 1e6:.1f} MB/s")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,42 @@
+from typing import Dict, List
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class RucioDIDResolver():
+    """
+    Resolve a Rucio DID (scope:name) to one XRootD replica per file
+    with the rucio client, which has to be installed and configured
+    """
+
+    def __init__(self) -> None:
+        self._client = None
+
+    def __call__(self, did: str) -> List[str]:
+        if self._client is None:
+            from rucio.client import Client
+            self._client = Client()
+        scope, name = did.split(":")
+        files = []
+        for replica in self._client.list_replicas(
+                [{'scope': scope, 'name': name}], schemes=['root']):
+            pfns = list(replica.get('pfns', {}).keys())
+            if not pfns:
+                raise ValueError(f"No XRootD replica of {replica['name']} "
+                                 f"in {did}")
+            files.append(pfns[0])
+        return files
+
+
+class LocalDIDResolver():
+    """
+    Resolve DIDs from a mapping DID -> list of files, e.g. for tests
+    or for sites without a rucio client
+    """
+
+    def __init__(self, files: Dict[str, List[str]]) -> None:
+        self._files = files
+
+    def __call__(self, did: str) -> List[str]:
+        return list(self._files[did])
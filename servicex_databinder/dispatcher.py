@@ -0,0 +1,97 @@
+from typing import Any, Dict, Iterable, List
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+POLICIES = ['least-outstanding', 'round-robin']
+
+
+def backends(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    ServiceX backends from ServiceXName - a backend name, or a list of
+    backend names or {Name, Weight} mappings
+    """
+    names = config['General']['ServiceXName']
+    if not isinstance(names, list):
+        names = [names]
+    return [{'name': b['Name'], 'weight': b.get('Weight', 1)}
+            if isinstance(b, dict) else {'name': b, 'weight': 1}
+            for b in names]
+
+
+def primary_backend(config: Dict[str, Any]) -> str:
+    """
+    First backend - used where one backend has to be picked (e.g. its type)
+    """
+    return backends(config)[0]['name']
+
+
+class BackendDispatcher():
+    """
+    Spread ServiceX requests over several backends
+      least-outstanding - backend with the fewest requests in flight
+                          relative to its weight
+      round-robin       - smooth weighted round-robin
+    and keep per-backend statistics
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.backends = backends(config)
+        self.policy = config['General'].get(
+            'LoadBalancing', 'least-outstanding').lower()
+        self.outstanding = {b['name']: 0 for b in self.backends}
+        self._current = {b['name']: 0 for b in self.backends}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._start = time.monotonic()
+        self.stats = {b['name']: {'completed': 0, 'failed': 0, 'bytes': 0}
+                      for b in self.backends}
+
+    @property
+    def names(self) -> List[str]:
+        return [b['name'] for b in self.backends]
+
+    def choose(self, exclude: Iterable[str] = ()) -> str:
+        """
+        Pick a backend for the next request, skipping the excluded ones
+        """
+        candidates = [b for b in self.backends if b['name'] not in exclude]
+        if not candidates:
+            raise ValueError("No ServiceX backend left to fail over to")
+        if self.policy == 'round-robin':
+            total = sum(b['weight'] for b in candidates)
+            for b in candidates:
+                self._current[b['name']] += b['weight']
+            name = max(candidates, key=lambda b: self._current[b['name']])
+            self._current[name['name']] -= total
+            return name['name']
+        return min(candidates, key=lambda b: (
+            self.outstanding[b['name']] / b['weight']))['name']
+
+    def start(self, name: str):
+        self.outstanding[name] += 1
+
+    def finish(self, name: str, nbytes: int = 0, failed: bool = False):
+        self.outstanding[name] -= 1
+        if failed:
+            self.stats[name]['failed'] += 1
+        else:
+            self.stats[name]['completed'] += 1
+            self.stats[name]['bytes'] += nbytes
+
+    def throughput(self, name: str) -> float:
+        """
+        Delivered bytes per second of a backend
+        """
+        elapsed = time.monotonic() - self._start
+        return self.stats[name]['bytes'] / elapsed if elapsed > 0 else 0.
+
+    def summary(self) -> Dict[str, str]:
+        """
+        Backend -> completed requests and throughput, for progress output
+        """
+        return {name: (f"{self.stats[name]['completed']} req "
+                       f"{self.throughput(name) / 1e6:.1f} MB/s")
+                for name in self.names}
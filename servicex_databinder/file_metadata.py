@@ -0,0 +1,66 @@
+from pathlib import Path
+from typing import Any, Dict, Union
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def parquet_metadata(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Rows, row group layout and schema from the parquet footer
+    """
+    import pyarrow.parquet as pq
+    metadata = pq.read_metadata(path)
+    offsets = [0]
+    for i in range(metadata.num_row_groups):
+        offsets.append(offsets[-1] + metadata.row_group(i).num_rows)
+    schema = metadata.schema.to_arrow_schema()
+    return {
+        'format': 'parquet',
+        'num_rows': metadata.num_rows,
+        'entry_offsets': offsets,
+        'schema': {field.name: str(field.type) for field in schema},
+        }
+
+
+def root_metadata(path: Union[str, Path],
+                  tree: str = None) -> Dict[str, Any]:
+    """
+    Entries, cluster layout (entries at which all baskets start) and
+    branch types of a TTree - the first TTree of the file if tree is None
+    """
+    import uproot
+    with uproot.open(path) as infile:
+        if tree is None:
+            trees = infile.keys(filter_classname="TTree", cycle=False)
+            if not trees:
+                raise ValueError(f"No TTree in {path}")
+            tree = trees[0]
+        ttree = infile[tree]
+        return {
+            'format': 'root',
+            'tree': tree,
+            'num_rows': ttree.num_entries,
+            'entry_offsets': [int(offset) for offset
+                              in ttree.common_entry_offsets()],
+            'schema': {name: branch.typename
+                       for name, branch in ttree.items()},
+            }
+
+
+def read_metadata(path: Union[str, Path], tree: str = None
+                  ) -> Dict[str, Any]:
+    """
+    Metadata of a delivered parquet or ROOT file: size, num_rows,
+    entry_offsets (row group or cluster boundaries) and schema.
+    Only the size is returned if the file cannot be read.
+    """
+    metadata = {'size': Path(path).stat().st_size}
+    try:
+        if Path(path).suffix == '.parquet':
+            metadata.update(parquet_metadata(path))
+        else:
+            metadata.update(root_metadata(path, tree))
+    except Exception as e:
+        log.debug(f"No metadata of {path}: {e!r}")
+    return metadata
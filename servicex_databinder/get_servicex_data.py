@@ -1,22 +1,33 @@
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Union
 import logging
 
-from aiohttp import ClientSession
 import asyncio
-from tqdm.asyncio import tqdm
+from pathlib import Path
 
-from servicex import ServiceXDataset, utils, servicex_config
 from .output_handler import OutputHandler
-
-import nest_asyncio
-nest_asyncio.apply()
+from .retry import call_with_retry, retry_policies, is_transient
+from .dispatcher import BackendDispatcher
+from .scheduler import RequestScheduler
+from .request import request_key
+from .manifest import request_hash
+from .metrics import DeliveryMetrics
 
 log = logging.getLogger(__name__)
 
 
+class DeliveryEvent(NamedTuple):
+    """
+    A delivered file - tree is None for Samples without Tree
+    """
+    sample: str
+    tree: Union[str, None]
+    path: str
+
+
 class DataBinderDataset:
 
-    def __init__(self, config: Dict[str, Any], servicex_requests: List):
+    def __init__(self, config: Dict[str, Any], servicex_requests: List,
+                 metrics: DeliveryMetrics = None):
         self._config = config
         self._servicex_requests = servicex_requests
         self._outputformat \
@@ -27,11 +38,30 @@ class DataBinderDataset:
         if 'IgnoreServiceXCache' in self._config['General'].keys():
             self.ignoreCache = self._config['General']['IgnoreServiceXCache']
         self.failed_request = []
-        self.endpoint = servicex_config.ServiceXConfigAdaptor()\
-            .get_backend_info(
-                self._config['General']['ServiceXName'],
-                "endpoint"
-                )
+        self._endpoints = None
+        self.max_concurrent_requests = \
+            self._config['General']['MaxConcurrentRequests']
+        self.request_counters = {'queued': 0, 'in_flight': 0, 'completed': 0}
+        self._semaphore = None
+        self.retry_policies = retry_policies(config)
+        self.scheduler = RequestScheduler(config)
+        self._events = None
+        self.dispatcher = BackendDispatcher(config)
+        self.metrics = metrics or DeliveryMetrics()
+
+    @property
+    def endpoints(self) -> Dict[str, str]:
+        """
+        ServiceX endpoints from servicex.yaml, looked up on first use
+        """
+        if self._endpoints is None:
+            from servicex import servicex_config
+            adaptor = servicex_config.ServiceXConfigAdaptor()
+            self._endpoints = {
+                name: adaptor.get_backend_info(name, "endpoint")
+                for name in self.dispatcher.names
+                }
+        return self._endpoints
 
     async def deliver_and_copy(self, req, delivery_setting):
         if req['codegen'] == "uproot":
@@ -42,62 +72,381 @@ class DataBinderDataset:
         if self._progresbar:
             callback_factory = None
         else:
+            from servicex import utils
             callback_factory = utils._run_default_wrapper
+        key = request_hash(req, self._config)
+        self.metrics.request(key, req)
+        callback_factory = self.metrics.status_factory(key, callback_factory)
 
+        self.request_counters['queued'] += 1
+        async with self._semaphore:
+            self.request_counters['queued'] -= 1
+            self.request_counters['in_flight'] += 1
+            self.metrics.mark(key, 'submitted')
+            try:
+                return await self._deliver_and_copy(
+                    req, delivery_setting, title, callback_factory, key
+                    )
+            finally:
+                self.request_counters['in_flight'] -= 1
+                self.request_counters['completed'] += 1
+
+    async def _deliver_and_copy(self, req, delivery_setting, title,
+                                callback_factory, key):
+        loop = asyncio.get_running_loop()
         try:
-            async with ClientSession(timeout=3600) as session:
-                sx_ds = ServiceXDataset(
-                    dataset=req['dataset'],
-                    backend_name=self._config['General']['ServiceXName'],
-                    backend_type=req['type'],
-                    codegen=req['codegen'],
-                    # image=self.transformerImage,
-                    status_callback_factory=callback_factory,
-                    session_generator=session,
-                    ignore_cache=self.ignoreCache
+            # Short-circuit requests already delivered and still valid
+            cached = await loop.run_in_executor(
+                None, self.output_handler.cached_request_files,
+                req, delivery_setting
+                )
+            if cached is not None:
+                await loop.run_in_executor(
+                    None, self.output_handler.index_files, req
                     )
-                query = req['query']
-                if delivery_setting == 1 or delivery_setting == 3:
-                    files = await sx_ds.get_data_parquet_async(
-                        query,
-                        title=title
-                        )
-                elif delivery_setting == 2 or delivery_setting == 4:
-                    files = await sx_ds.get_data_rootfiles_async(
-                        query,
-                        title=title
-                        )
-                elif delivery_setting == 5:
-                    files = await sx_ds.get_data_parquet_uri_async(
-                        query,
-                        title=title
-                        )
-                elif delivery_setting == 6:
-                    files = await sx_ds.get_data_rootfiles_uri_async(
-                        query,
-                        title=title
-                        )
+                self.output_handler.update_output_paths_dict(
+                    req, cached, delivery_setting
+                    )
+                self._emit(req, cached)
+                await self._fan_out(req, cached, delivery_setting)
+                self.metrics.mark(key, 'completed', status='cached',
+                                  files=len(cached))
+                return
+
+            # Files are post-processed (converted or merged) per request
+            post_process = delivery_setting in [1, 2, 7, 8] and (
+                self._config['General'].get('ConvertTo')
+                or self._config['General'].get('MergeTargetSize'))
+
+            files = await self._fetch_files(
+                req, delivery_setting, title, callback_factory, key,
+                None if post_process else set()
+                )
+
+            # Copy files off the event loop
+            await loop.run_in_executor(
+                None, self.output_handler.copy_to_target,
+                delivery_setting, req, files
+                )
+            self.metrics.mark(key, 'copied')
+
+            # Convert while other requests are still in flight
+            if self._config['General'].get('ConvertTo') \
+                    and delivery_setting in [1, 2, 7, 8]:
+                await self.output_handler.convert_request(req)
+
+            # Merge small files into files of MergeTargetSize
+            if self._config['General'].get('MergeTargetSize') \
+                    and delivery_setting in [1, 2, 7, 8]:
+                await self.output_handler.merge_request(req)
+
+            # Checksums, rows, layout and schema of the delivered files
+            await loop.run_in_executor(
+                None, self.output_handler.index_files, req
+                )
 
             # Update Outfile paths dictionary
             self.output_handler.update_output_paths_dict(
                 req, files, delivery_setting
                 )
+            if self._events is not None and post_process:
+                self._emit(req, self.output_handler.delivered_paths(req))
 
-            self.output_handler.copy_to_target(delivery_setting, req, files)
+            # Samples which made the same request
+            await self._fan_out(req, files, delivery_setting)
+            self.metrics.mark(key, 'completed', status='delivered')
         except Exception as e:
             self.failed_request.append({"request": req, "error": repr(e)})
+            # Samples which made the same request are not delivered either
+            for dup in req.get('fanout', []):
+                self.failed_request.append({"request": dup,
+                                            "error": repr(e),
+                                            "fanout_of": req['Sample']})
+            self.metrics.mark(key, 'completed', status='failed')
+            samples = ", ".join([req['Sample']] + [
+                dup['Sample'] for dup in req.get('fanout', [])])
             if req['codegen'] == "uproot":
                 return ("  Fail to deliver "
-                        f"{req['Sample']} | "
+                        f"{samples} | "
                         f"{req['tree']} | "
                         f"{str(req['dataset'])[:100]}")
             elif req['codegen'] == "atlasr21":
                 return ("  Fail to deliver "
-                        f"{req['Sample']} | "
+                        f"{samples} | "
                         f"{str(req['dataset'])[:100]}")
+        finally:
+            # identical requests built from now on are submitted on
+            # their own
+            req['_finished'] = True
+
+    async def _fetch_files(self, req, delivery_setting, title,
+                           callback_factory, key, emitted):
+        """
+        Fetch files of a request from the backend picked by the dispatcher.
+        Transient errors are retried on the same backend first, then the
+        request fails over to the next backend.
+        """
+        from servicex import ServiceXDataset
+
+        tried = []
+        while True:
+            backend = self.dispatcher.choose(exclude=tried)
+            tried.append(backend)
+            sx_ds = ServiceXDataset(
+                dataset=req['dataset'],
+                backend_name=backend,
+                backend_type=req['type'],
+                codegen=req['codegen'],
+                # image=self.transformerImage,
+                status_callback_factory=callback_factory,
+                ignore_cache=self.ignoreCache
+                )
+
+            async def fetch():
+                if self._events is not None:
+                    return await self._stream_files(
+                        sx_ds, req['query'], title, req, delivery_setting,
+                        emitted
+                        )
+                return await self._get_files(
+                    sx_ds, req['query'], title, delivery_setting
+                    )
+
+            self.dispatcher.start(backend)
+            try:
+                # Retry transient errors according to the retry policies
+                files = await call_with_retry(
+                    fetch, self.retry_policies, f"{title} @ {backend}"
+                    )
+            except Exception as e:
+                self.dispatcher.finish(backend, failed=True)
+                # fail over only if the backend is unavailable - other
+                # errors repeat on every backend
+                if is_transient(e) is not True \
+                        or len(tried) == len(self.dispatcher.names):
+                    raise
+                log.warning(f"{title} - {type(e).__name__} from {backend}, "
+                            "failing over to another backend")
+                continue
+            nbytes = 0
+            if delivery_setting != 5 and delivery_setting != 6:
+                nbytes = sum(Path(file).stat().st_size for file in files)
+            self.dispatcher.finish(backend, nbytes)
+            # the status callback may not report e.g. cached transforms
+            self.metrics.mark(key, 'transformed')
+            self.metrics.mark(key, 'downloaded', backend=backend,
+                              files=len(files), bytes=nbytes)
+            return files
+
+    async def _get_files(self, sx_ds, query, title, delivery_setting):
+        if delivery_setting in [1, 3, 7]:
+            return await sx_ds.get_data_parquet_async(
+                query,
+                title=title
+                )
+        elif delivery_setting in [2, 4, 8]:
+            return await sx_ds.get_data_rootfiles_async(
+                query,
+                title=title
+                )
+        elif delivery_setting == 5:
+            return await sx_ds.get_data_parquet_uri_async(
+                query,
+                title=title
+                )
+        elif delivery_setting == 6:
+            return await sx_ds.get_data_rootfiles_uri_async(
+                query,
+                title=title
+                )
+
+    async def _fan_out(self, req, files, delivery_setting):
+        loop = asyncio.get_running_loop()
+        # the list may grow while requests are still being built
+        for dup in req.get('fanout', []):
+            await loop.run_in_executor(
+                None, self.output_handler.fan_out,
+                delivery_setting, req, dup, files
+                )
+            self.metrics.count('fanned_out_requests')
+            if delivery_setting in [1, 2, 7, 8]:
+                self._emit(dup, self.output_handler.delivered_paths(dup))
+            elif delivery_setting == 5 or delivery_setting == 6:
+                self._emit(dup, [file.url for file in files])
+            else:
+                self._emit(dup, files)
+
+    def _emit(self, req, paths):
+        """
+        Push delivered files to the stream of stream_data()
+        """
+        if self._events is None:
+            return
+        tree = req['tree'] if req['codegen'] == "uproot" else None
+        for path in paths:
+            self._events.put_nowait(
+                DeliveryEvent(req['Sample'], tree, str(path))
+                )
+
+    async def _stream_files(self, sx_ds, query, title, req,
+                            delivery_setting, emitted):
+        """
+        Fetch files with the servicex streaming API and copy each file
+        as it arrives. Files are emitted right away unless emitted is None
+        (post-processed requests are emitted once they are complete).
+        """
+        if delivery_setting in [1, 3, 7]:
+            stream = sx_ds.get_data_parquet_stream(query, title=title)
+        elif delivery_setting in [2, 4, 8]:
+            stream = sx_ds.get_data_rootfiles_stream(query, title=title)
+        elif delivery_setting == 5:
+            stream = sx_ds.get_data_parquet_uri_stream(query, title=title)
+        elif delivery_setting == 6:
+            stream = sx_ds.get_data_rootfiles_uri_stream(query, title=title)
 
-    async def get_data(self, overall_progress_only):
-        log.info(f"Deliver via ServiceX endpoint: {self.endpoint}")
+        loop = asyncio.get_running_loop()
+        files = []
+        async for info in stream:
+            if delivery_setting == 5 or delivery_setting == 6:
+                files.append(info)
+                path = info.url
+            else:
+                files.append(info.path)
+                path = info.path
+                if delivery_setting in [1, 2, 7, 8]:
+                    path = await loop.run_in_executor(
+                        None, self.output_handler.copy_file_to_target,
+                        delivery_setting, req, info.path
+                        )
+            # a retried stream yields the same files again
+            if emitted is not None and str(path) not in emitted:
+                emitted.add(str(path))
+                self._emit(req, [path])
+        return files
+
+    async def _run_requests(self, requests, delivery_setting,
+                            overall_progress_only):
+        """
+        Run ServiceX requests, at most MaxConcurrentRequests at a time
+        """
+        from tqdm.asyncio import tqdm
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        log.debug("Maximum number of concurrent ServiceX requests: "
+                  f"{self.max_concurrent_requests}")
+
+        if overall_progress_only:
+            barformat = ("{l_bar}{bar}| {n_fmt}/{total_fmt} "
+                         "[{elapsed}{postfix}]")
+            pbar = tqdm(total=0,
+                        unit="request",
+                        dynamic_ncols=True,
+                        colour='#ffa500',
+                        bar_format=barformat,
+                        )
+        incoming = self._incoming_requests(requests, delivery_setting)
+        pending = set()
+        getter = None
+        while pending or incoming is not None:
+            waits = set(pending)
+            if incoming is not None:
+                getter = getter or asyncio.ensure_future(
+                    incoming.__anext__()
+                    )
+                waits.add(getter)
+            done, _ = await asyncio.wait(
+                waits, return_when=asyncio.FIRST_COMPLETED
+                )
+            if getter in done:
+                try:
+                    req = getter.result()
+                except StopAsyncIteration:
+                    incoming = None
+                else:
+                    # Tasks wait on the semaphore in the order they
+                    # are created, i.e. the order of submission
+                    pending.add(asyncio.ensure_future(
+                        self.deliver_and_copy(req, delivery_setting)
+                        ))
+                    if overall_progress_only:
+                        pbar.total += 1
+                        pbar.refresh()
+                getter = None
+            for f in done.intersection(pending):
+                pending.remove(f)
+                value = f.result()
+                if overall_progress_only:
+                    pbar.set_description(value)
+                    backends = {}
+                    if len(self.dispatcher.names) > 1:
+                        backends = self.dispatcher.summary()
+                    pbar.set_postfix(
+                        in_flight=self.request_counters['in_flight'],
+                        queued=self.request_counters['queued'],
+                        **backends
+                        )
+                    pbar.update()
+
+        if overall_progress_only:
+            pbar.close()
+
+    async def _incoming_requests(self, requests, delivery_setting=None):
+        """
+        Requests in the order of submission. A list of requests is
+        ordered by the scheduler; an iterator of requests (pipelined
+        request building) is consumed in a worker thread and its
+        requests are submitted as soon as they are built.
+        """
+        loop = asyncio.get_running_loop()
+        if isinstance(requests, list):
+            for req in await loop.run_in_executor(
+                    None, self.scheduler.order, requests,
+                    lambda req: self.output_handler.is_cached(
+                        req, delivery_setting)):
+                yield req
+            return
+
+        queue = asyncio.Queue()
+        end = object()
+
+        def produce():
+            try:
+                for req in requests:
+                    loop.call_soon_threadsafe(queue.put_nowait, req)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, end)
+
+        producer = loop.run_in_executor(None, produce)
+        primaries = {}
+        while True:
+            req = await queue.get()
+            if req is end:
+                break
+            # Identical requests of Samples built later join the fan-out
+            # of the submitted request unless it is already finished
+            # (delivered or failed)
+            primary = primaries.setdefault(request_key(req), req)
+            if primary is not req:
+                if req['Sample'] in [r['Sample'] for r in
+                                     [primary] + primary.get('fanout', [])]:
+                    continue
+                if not primary.get('_finished'):
+                    primary.setdefault('fanout', []).append(req)
+                    continue
+            yield req
+        await producer
+
+    async def get_data(self, overall_progress_only, requests=None):
+        """
+        Deliver all ServiceX requests, or only the given requests
+        """
+        if requests is None:
+            requests = self._servicex_requests
+        if callable(requests):
+            requests = requests()
+        if requests:
+            for endpoint in self.endpoints.values():
+                log.info(f"Deliver via ServiceX endpoint: {endpoint}")
 
         if self._outputformat == "parquet" and \
                 self._config['General']['Delivery'] == "localpath":
@@ -117,40 +466,94 @@ class DataBinderDataset:
         elif self._outputformat == "root" and \
                 self._config['General']['Delivery'] == "objectstore":
             delivery_setting = 6
+        elif self._outputformat == "parquet" and \
+                self._config['General']['Delivery'] == "locallink":
+            delivery_setting = 7
+        elif self._outputformat == "root" and \
+                self._config['General']['Delivery'] == "locallink":
+            delivery_setting = 8
 
         self._progresbar = overall_progress_only
+        self.request_counters = {'queued': 0, 'in_flight': 0, 'completed': 0}
 
-        tasks = []
-
-        for req in self._servicex_requests:
-            tasks.append(self.deliver_and_copy(req, delivery_setting))
-
-        if overall_progress_only:
-            barformat = "{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}]"
-            pbar = tqdm(total=len(tasks),
-                        unit="request",
-                        dynamic_ncols=True,
-                        colour='#ffa500',
-                        bar_format=barformat,
-                        )
-        for f in asyncio.as_completed(tasks):
-            value = await f
-            if overall_progress_only:
-                pbar.set_description(value)
-                pbar.update()
-            else:
-                pass
+        loop = asyncio.get_running_loop()
+        # Samples from LocalPath are available right away
+        await loop.run_in_executor(
+            None, self.output_handler.add_local_output_paths_dict
+            )
+        if self._events is not None:
+            local_samples = {sample['Name'] for sample in
+                             self._config['Sample'] if 'LocalPath' in sample}
+            for sample, tree, files in self.output_handler.catalog:
+                if sample in local_samples:
+                    for path in files:
+                        self._events.put_nowait(
+                            DeliveryEvent(sample, tree, path)
+                            )
 
-        if overall_progress_only:
-            pbar.close()
+        if requests:
+            self.dispatcher.reset_stats()
+            with self.metrics.phase('deliver'):
+                await self._run_requests(requests, delivery_setting,
+                                         overall_progress_only)
+            if len(self.dispatcher.names) > 1:
+                for name, summary in self.dispatcher.summary().items():
+                    log.info(f"  {name}: {summary}, "
+                             f"{self.dispatcher.stats[name]['failed']} "
+                             "failed")
 
-        self.output_handler.add_local_output_paths_dict()
+        copy_engine = self.output_handler.copy_engine
+        self.metrics.record('files_copied', copy_engine.files_copied)
+        self.metrics.record('files_linked', copy_engine.files_linked)
+        self.metrics.record('bytes_copied', copy_engine.bytes_copied)
 
-        if delivery_setting == 1 or delivery_setting == 2:
+        if delivery_setting in [1, 2, 7, 8]:
             log.info(f"Delivered at {self.output_handler.output_path}")
+            if self.output_handler.copy_engine.files_copied \
+                    or self.output_handler.copy_engine.files_linked:
+                log.info(f"  {self.output_handler.copy_engine.report()}")
 
-        self.output_handler.write_output_paths_dict(
-            self.output_handler.out_paths_dict
+        # Blocking file I/O and pool shutdown off the event loop
+        await loop.run_in_executor(
+            None, self.output_handler.write_output_paths_dict
             )
+        await loop.run_in_executor(None, self.output_handler.manifest.save)
+        await loop.run_in_executor(None, self.output_handler.close)
 
         return self.output_handler.out_paths_dict
+
+    async def retry_failed(self, overall_progress_only):
+        """
+        Re-submit only the failed requests
+        """
+        # fan-out Samples are delivered again by their primary request
+        requests = [failed['request'] for failed in self.failed_request
+                    if 'fanout_of' not in failed]
+        self.failed_request = []
+        return await self.get_data(overall_progress_only, requests)
+
+    async def stream_data(self, overall_progress_only
+                          ) -> AsyncIterator[DeliveryEvent]:
+        """
+        Run get_data() and yield each file as soon as it is delivered
+        """
+        self._events = asyncio.Queue()
+        task = asyncio.ensure_future(self.get_data(overall_progress_only))
+        try:
+            while True:
+                getter = asyncio.ensure_future(self._events.get())
+                done, _ = await asyncio.wait(
+                    {getter, task}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                if getter in done:
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                break
+            while not self._events.empty():
+                yield self._events.get_nowait()
+            task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+            self._events = None
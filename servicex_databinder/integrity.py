@@ -0,0 +1,46 @@
+from pathlib import Path
+from typing import Union
+import zlib
+
+import logging
+log = logging.getLogger(__name__)
+
+ALGORITHMS = ['adler32', 'xxh64']
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _blocks(path: Union[str, Path]):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            yield block
+
+
+def file_checksum(path: Union[str, Path], algorithm: str = 'adler32') -> str:
+    """
+    Checksum of a file as "algorithm:hex" - adler32 (zero-padded as
+    in Rucio) or xxh64 (requires the xxhash package)
+    """
+    if algorithm == 'xxh64':
+        import xxhash
+        h = xxhash.xxh64()
+        for block in _blocks(path):
+            h.update(block)
+        return f"xxh64:{h.hexdigest()}"
+    if algorithm != 'adler32':
+        raise ValueError(f"Unsupported checksum algorithm {algorithm}")
+    value = 1
+    for block in _blocks(path):
+        value = zlib.adler32(block, value)
+    return f"adler32:{value:08x}"
+
+
+def matches_checksum(path: Union[str, Path], checksum: str) -> bool:
+    """
+    Whether the file still has the recorded checksum - False if it
+    cannot be read
+    """
+    try:
+        return file_checksum(path, checksum.split(':', 1)[0]) == checksum
+    except OSError as e:
+        log.debug(f"Cannot checksum {path}: {e!r}")
+        return False
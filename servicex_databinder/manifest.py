@@ -0,0 +1,306 @@
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Union
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import time
+
+from .integrity import matches_checksum
+
+import logging
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".servicex_databinder_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def request_hash(req: Dict[str, Any], config: Dict[str, Any]) -> str:
+    """
+    Stable hash of a ServiceX request, the output format
+    and the post-delivery conversion and merging
+    """
+    key = [
+        req['Sample'], req['tree'], req['dataset'], req['codegen'],
+        req['query'], config['General']['OutputFormat'].lower()
+        ]
+    if config['General'].get('ConvertTo'):
+        key += [config['General'].get(option) for option in
+                ['ConvertTo', 'ConvertCompression', 'ConvertRowGroupSize']]
+    if config['General'].get('MergeTargetSize'):
+        key += [config['General']['MergeTargetSize']]
+    return hashlib.sha1(
+        json.dumps(key, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+
+def cache_key(req: Dict[str, Any], config: Dict[str, Any]) -> str:
+    """
+    Key of the result cache - identical transforms on the same backend
+    """
+    key = [
+        req['dataset'], req['tree'], req['codegen'], req['query'],
+        config['General']['OutputFormat'].lower(),
+        config['General']['ServiceXName']
+        ]
+    return hashlib.sha1(
+        json.dumps(key, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+
+class DeliveryManifest():
+    """
+    Persistent index of the delivered files in the OutputDirectory.
+
+    requests: request hash -> {sample, tree, target, delivered_at, cache_key,
+                               files: {ServiceX file name: relative path}}
+    files: relative path -> {size, mtime, checksum, metadata,
+                             sources (merged files only)}
+    outputs: relative paths of the output dictionaries and their
+             chunk plan and file metadata
+    """
+
+    def __init__(self, output_path: Union[str, Path]) -> None:
+        self.output_path = Path(output_path)
+        self.path = Path(self.output_path, MANIFEST_NAME)
+        self._lock = Lock()
+        self.requests = {}
+        self.files = {}
+        self.outputs = []
+        self.is_new = True
+        self.load()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            content = json.loads(self.path.read_text())
+            if content.get('version') != MANIFEST_VERSION:
+                raise ValueError(f"version {content.get('version')}")
+            self.requests = content['requests']
+            self.files = content['files']
+            self.outputs = content.get('outputs', [])
+            self.is_new = False
+        except Exception as e:
+            log.warning(f"Ignoring unreadable manifest {self.path}: {e!r}")
+            self.requests, self.files, self.outputs = {}, {}, []
+
+    def save(self):
+        with self._lock:
+            content = {
+                'version': MANIFEST_VERSION,
+                'requests': self.requests,
+                'files': self.files,
+                'outputs': self.outputs
+                }
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(content, separators=(',', ':')))
+            os.replace(tmp, self.path)
+
+    def relative(self, path: Union[str, Path]) -> str:
+        return Path(path).relative_to(self.output_path).as_posix()
+
+    def delivered_files(self, req_hash: str) -> Dict[str, str]:
+        """
+        ServiceX file name -> relative path of files delivered by a request
+        """
+        entry = self.requests.get(req_hash)
+        if entry is None:
+            return {}
+        return {name: rel for name, rel in entry['files'].items()
+                if rel in self.files}
+
+    def record(self, req_hash: str, req: Dict[str, Any],
+               target_path: Path, names: Iterable[str],
+               cache_key: str = None):
+        """
+        Add delivered files of a request to the index
+        """
+        stats = {}
+        for name in names:
+            st = Path(target_path, name).stat()
+            stats[self.relative(Path(target_path, name))] \
+                = {'size': st.st_size, 'mtime': st.st_mtime}
+        with self._lock:
+            entry = self.requests.setdefault(req_hash, {
+                'sample': req['Sample'],
+                'tree': req['tree'],
+                'target': self.relative(target_path),
+                'files': {}
+                })
+            # a request is complete (and cacheable) once its key is set
+            if cache_key is not None:
+                entry['delivered_at'] = time.time()
+                entry['cache_key'] = cache_key
+            for rel in stats:
+                entry['files'][Path(rel).name] = rel
+            self.files.update(stats)
+
+    def file_metadata(self, rel: str) -> Union[Dict[str, Any], None]:
+        info = self.files.get(rel)
+        return info.get('metadata') if info is not None else None
+
+    def set_file_metadata(self, metadata: Dict[str, Dict[str, Any]]):
+        """
+        Attach metadata (rows, layout, schema) to files in the index
+        """
+        with self._lock:
+            for rel, meta in metadata.items():
+                if rel in self.files:
+                    self.files[rel]['metadata'] = meta
+
+    def set_checksums(self, checksums: Dict[str, str]):
+        """
+        Record checksums ("algorithm:hex") of files in the index
+        """
+        with self._lock:
+            for rel, checksum in checksums.items():
+                if rel in self.files:
+                    self.files[rel]['checksum'] = checksum
+
+    def matches(self, path: Union[str, Path]) -> bool:
+        """
+        Whether a file on disk has the size recorded in the index -
+        a copy cut short (e.g. by a killed job) does not
+        """
+        info = self.files.get(self.relative(path))
+        try:
+            return info is not None \
+                and Path(path).stat().st_size == info['size']
+        except OSError:
+            return False
+
+    def retain(self, req_hash: str, names: Iterable[str]):
+        """
+        Keep only the given ServiceX files in the mapping of a request
+        """
+        names = set(names)
+        with self._lock:
+            entry = self.requests.get(req_hash)
+            if entry is not None:
+                entry['files'] = {name: rel for name, rel
+                                  in entry['files'].items() if name in names}
+
+    def replace_files(self, old_rels: Iterable[str],
+                      new_path: Union[str, Path],
+                      sources: List[str] = None):
+        """
+        Replace delivered files by a file derived from them
+        (e.g. converted or merged) in the index. sources records the
+        ServiceX files a merged file is made of.
+        """
+        old_rels = set(old_rels)
+        st = Path(new_path).stat()
+        new_rel = self.relative(new_path)
+        with self._lock:
+            for rel in old_rels:
+                self.files.pop(rel, None)
+            self.files[new_rel] = {'size': st.st_size, 'mtime': st.st_mtime}
+            if sources is not None:
+                self.files[new_rel]['sources'] = sources
+            for entry in self.requests.values():
+                for name, rel in entry['files'].items():
+                    if rel in old_rels:
+                        entry['files'][name] = new_rel
+
+    def cached_files(self, req_hash: str, key: str,
+                     ttl: float = None) -> Union[List[Path], None]:
+        """
+        Delivered files of a request if the result cache entry is valid:
+        same cache key, not expired, and all files present with the
+        recorded size. Returns None otherwise.
+        """
+        entry = self.requests.get(req_hash)
+        if entry is None or entry.get('cache_key') != key:
+            return None
+        if ttl and time.time() - entry['delivered_at'] > ttl:
+            return None
+        paths = []
+        for rel in dict.fromkeys(entry['files'].values()):
+            info = self.files.get(rel)
+            path = Path(self.output_path, rel)
+            try:
+                if info is None or path.stat().st_size != info['size']:
+                    return None
+            except OSError:
+                return None
+            paths.append(path)
+        return paths
+
+    def invalidate(self, sample: str = None):
+        """
+        Invalidate result cache entries of a Sample or of all Samples
+        """
+        with self._lock:
+            for entry in self.requests.values():
+                if sample is None or entry['sample'] == sample:
+                    entry.pop('cache_key', None)
+
+    def tracked_files(self) -> List[str]:
+        return list(self.files.keys())
+
+    def forget_files(self, rel_paths: Iterable[str]):
+        """
+        Drop files from the index together with the mapping of requests.
+        Requests which lose files are no longer served by the result cache.
+        """
+        rel_paths = set(rel_paths)
+        if not rel_paths:
+            return
+        with self._lock:
+            for rel in rel_paths:
+                self.files.pop(rel, None)
+            for req_hash in list(self.requests.keys()):
+                entry = self.requests[req_hash]
+                files = {name: rel for name, rel in entry['files'].items()
+                         if rel not in rel_paths}
+                if len(files) < len(entry['files']):
+                    entry.pop('cache_key', None)
+                entry['files'] = files
+                if not entry['files']:
+                    del self.requests[req_hash]
+
+    def verify(self, checksum: bool = False,
+               workers: int = 8) -> Dict[str, List[str]]:
+        """
+        Walk the OutputDirectory and reconcile the index with the files
+        on disk. Missing or modified files are dropped from the index
+        so that the next delivery copies them again. With checksum,
+        files with a recorded checksum are also re-hashed in parallel
+        and corrupted files are dropped as well.
+        """
+        on_disk = {}
+        for sample_dir in self.output_path.iterdir():
+            if not sample_dir.is_dir():
+                continue
+            for f in sample_dir.rglob("*"):
+                if f.is_file():
+                    on_disk[self.relative(f)] = f.stat()
+
+        report = {'missing': [], 'modified': [], 'untracked': []}
+        for rel, info in self.files.items():
+            st = on_disk.get(rel)
+            if st is None:
+                report['missing'].append(rel)
+            elif st.st_size != info['size'] or st.st_mtime != info['mtime']:
+                report['modified'].append(rel)
+        report['untracked'] = sorted(set(on_disk).difference(self.files))
+
+        report['corrupted'] = []
+        if checksum:
+            changed = set(report['missing'] + report['modified'])
+            rels = [rel for rel, info in self.files.items()
+                    if 'checksum' in info and rel not in changed]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                intact = executor.map(
+                    lambda rel: matches_checksum(
+                        Path(self.output_path, rel),
+                        self.files[rel]['checksum']),
+                    rels
+                    )
+                report['corrupted'] = [rel for rel, ok in zip(rels, intact)
+                                       if not ok]
+        self.forget_files(report['missing'] + report['modified']
+                          + report['corrupted'])
+        return report
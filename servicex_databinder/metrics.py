@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+from typing import Any, Dict, List
+from threading import Lock
+import json
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+# stage of a request -> (start event, end event)
+REQUEST_STAGES = {
+    'queue': ('queued', 'submitted'),
+    'transform': ('submitted', 'transformed'),
+    'download': ('transformed', 'downloaded'),
+    'copy': ('downloaded', 'copied'),
+    'post_process': ('copied', 'completed'),
+    }
+
+
+def _value(value: float) -> str:
+    # counters such as bytes must not lose digits
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+            .replace('\n', '\\n')
+    return ",".join(f'{key}="{escape(value)}"'
+                    for key, value in labels.items() if value is not None)
+
+
+class DeliveryMetrics():
+    """
+    Timing and throughput of a DataBinder: durations of the delivery
+    phases (config loading, request building, requests, clean-up) and
+    per-request timestamps, files and bytes
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.phases = {}
+        self.requests = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            with self._lock:
+                self.phases[name] = {'start': start, 'end': end,
+                                     'duration': end - start}
+
+    def request(self, key: str, req: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        New metrics entry of a request when it is queued - replaces the
+        entry of an earlier (e.g. failed) submission
+        """
+        with self._lock:
+            self.requests[key] = {
+                'sample': req['Sample'],
+                'tree': req['tree'] if req['codegen'] == "uproot" else None,
+                'backend': None,
+                'status': None,
+                'files': 0,
+                'bytes': 0,
+                'queued': time.time(),
+                }
+            return self.requests[key]
+
+    def mark(self, key: str, event: str, **values):
+        """
+        Timestamp of a request event (the first one counts) and values
+        """
+        with self._lock:
+            entry = self.requests[key]
+            entry.setdefault(event, time.time())
+            entry.update(values)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = value
+
+    def status_factory(self, key: str, factory=None):
+        """
+        Wrap a servicex status callback factory to timestamp the end of
+        the transform and of the download of a request
+        """
+        def wrapped_factory(ds_name, title, downloading):
+            callback = factory(ds_name, title, downloading) \
+                if factory is not None else None
+
+            def update(total, processed, downloaded, failed):
+                if total is not None and total > 0:
+                    if processed + failed >= total:
+                        self.mark(key, 'transformed')
+                    if downloading and downloaded >= total:
+                        self.mark(key, 'downloaded')
+                if callback is not None:
+                    callback(total, processed, downloaded, failed)
+            return update
+        return wrapped_factory
+
+    def _stages(self, entry: Dict[str, Any]) -> Dict[str, float]:
+        stages = {}
+        for stage, (start, end) in REQUEST_STAGES.items():
+            if start in entry and end in entry:
+                stages[stage] = max(entry[end] - entry[start], 0.)
+        return stages
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = {key: dict(entry, stages=self._stages(entry))
+                        for key, entry in self.requests.items()}
+            metrics = {
+                'phases': {name: dict(phase)
+                           for name, phase in self.phases.items()},
+                'requests': requests,
+                'counters': dict(self.counters),
+                }
+        # time spent in each stage, summed over requests
+        metrics['stages'] = {stage: sum(r['stages'].get(stage, 0.)
+                                        for r in requests.values())
+                             for stage in REQUEST_STAGES}
+        deliver = metrics['phases'].get('deliver')
+        if deliver and deliver['duration'] > 0:
+            metrics['throughput'] = {
+                'bytes_per_second': sum(r['bytes'] for r in requests.values())
+                / deliver['duration'],
+                'files_per_second': sum(r['files'] for r in requests.values())
+                / deliver['duration'],
+                }
+        return metrics
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def to_prometheus(self, prefix: str = "servicex_databinder") -> str:
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        metrics = self.as_dict()
+        lines = []
+
+        def metric(name, kind, doc, samples):
+            lines.append(f"# HELP {prefix}_{name} {doc}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{{{labels}}} {_value(value)}"
+                             if labels
+                             else f"{prefix}_{name} {_value(value)}")
+
+        metric("phase_seconds", "gauge", "Duration of delivery phases",
+               [(_labels(phase=name), phase['duration'])
+                for name, phase in metrics['phases'].items()])
+        # a Sample and Tree may have several requests (e.g. shards)
+        metric("request_stage_seconds", "gauge",
+               "Duration of the stages of each request",
+               [(_labels(sample=r['sample'], tree=r['tree'], request=key,
+                         stage=stage), duration)
+                for key, r in metrics['requests'].items()
+                for stage, duration in r['stages'].items()])
+        statuses = {}
+        for r in metrics['requests'].values():
+            status = r['status'] or 'unknown'
+            statuses[status] = statuses.get(status, 0) + 1
+        metric("requests_total", "counter", "Requests by status",
+               [(_labels(status=status), n)
+                for status, n in statuses.items()])
+        metric("files_total", "counter", "Files delivered by requests",
+               [("", sum(r['files'] for r in metrics['requests'].values()))])
+        metric("bytes_total", "counter", "Bytes delivered by requests",
+               [("", sum(r['bytes'] for r in metrics['requests'].values()))])
+        for name, value in metrics['counters'].items():
+            metric(f"{name}_total", "counter", name.replace('_', ' '),
+                   [("", value)])
+        if 'throughput' in metrics:
+            metric("throughput_bytes_per_second", "gauge",
+                   "Delivered bytes per second of the last delivery",
+                   [("", metrics['throughput']['bytes_per_second'])])
+        return "\n".join(lines) + "\n"
+
+    def spans(self) -> List[Dict[str, Any]]:
+        """
+        OpenTelemetry-style spans: one per phase, one per request with
+        its stages as child spans. Times are in seconds since the epoch.
+        """
+        metrics = self.as_dict()
+        spans = [{'name': name, 'start': phase['start'], 'end': phase['end'],
+                  'attributes': {}, 'parent': None}
+                 for name, phase in metrics['phases'].items()]
+        for key, r in metrics['requests'].items():
+            if 'queued' not in r or 'completed' not in r:
+                continue
+            attributes = {k: r[k] for k in
+                          ['sample', 'tree', 'backend', 'status',
+                           'files', 'bytes'] if r[k] is not None}
+            spans.append({'name': 'request', 'id': key,
+                          'start': r['queued'], 'end': r['completed'],
+                          'attributes': attributes, 'parent': None})
+            for stage, (start, end) in REQUEST_STAGES.items():
+                if start in r and end in r:
+                    spans.append({'name': stage, 'start': r[start],
+                                  'end': r[end], 'attributes': {},
+                                  'parent': key})
+        return spans
+
+    def export_spans(self, tracer=None) -> int:
+        """
+        Emit the spans with OpenTelemetry if the opentelemetry API is
+        installed. Returns the number of exported spans.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            log.warning("opentelemetry is not installed - no spans exported")
+            return 0
+        tracer = tracer or trace.get_tracer("servicex_databinder")
+        spans = self.spans()
+        parents = {}
+        for span in spans:
+            if span['parent'] is not None:
+                continue
+            otel_span = tracer.start_span(
+                span['name'], start_time=int(span['start'] * 1e9),
+                attributes=span['attributes'])
+            otel_span.end(end_time=int(span['end'] * 1e9))
+            if 'id' in span:
+                parents[span['id']] = otel_span
+        for span in spans:
+            if span['parent'] in parents:
+                context = trace.set_span_in_context(parents[span['parent']])
+                otel_span = tracer.start_span(
+                    span['name'], context=context,
+                    start_time=int(span['start'] * 1e9))
+                otel_span.end(end_time=int(span['end'] * 1e9))
+        return len(spans)
@@ -1,11 +1,20 @@
-import yaml
+import asyncio
+import json
+import os
 from pathlib import Path
-from typing import Any, Dict
-from shutil import rmtree, copy
+from typing import Any, Dict, List
+from shutil import rmtree
+from concurrent.futures import (Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
 
-import pyarrow.parquet as pq
-import awkward as ak
-import uproot
+from .copy_engine import CopyEngine
+from . import converter
+from . import compaction
+from .manifest import DeliveryManifest, request_hash, cache_key
+from .catalog import OutputCatalog, FORMATS
+from .file_metadata import read_metadata
+from .integrity import file_checksum
+from .chunking import chunk_plan
 
 import logging
 log = logging.getLogger(__name__)
@@ -18,21 +27,9 @@ class OutputHandler():
         self._outputformat \
             = self._config.get('General')['OutputFormat'].lower()
         """
-        Prepare output path dictionary
+        Prepare output path catalog
         """
-        out_paths = {}
-        samples = []
-        [samples.append(sample['Name'])
-            for sample in config['Sample'] if sample['Name'] not in samples]
-        for sample in samples:
-            out_paths[sample] = {}
-        for sample in config['Sample']:
-            # if sample['Transformer'] == "uproot":
-            if 'Tree' in sample.keys():
-                for tree in sample['Tree'].split(','):
-                    out_paths[sample['Name']][tree.strip()] = []
-
-        self.out_paths_dict = out_paths
+        self.catalog = OutputCatalog(config)
 
         """
         Create output directory
@@ -46,7 +43,22 @@ class OutputHandler():
             self.output_path = Path('ServiceXData').absolute()
             self.output_path.mkdir(parents=True, exist_ok=True)
 
+        self.copy_engine = CopyEngine(self._config['General']['CopyWorkers'])
+        self.manifest = DeliveryManifest(self.output_path)
+        self._process_pool = None
+
+    @property
+    def out_paths_dict(self) -> Dict[str, Any]:
+        """
+        Nested dictionary of output paths from the catalog
+        """
+        return self.catalog.as_dict()
+
     def copy_to_target(self, delivery_setting, req, files):
+        """
+        Copy delivered files into OutputDirectory - blocking,
+        run it in an executor from the event loop
+        """
         if req['codegen'] == "uproot":
             target_path = Path(self.output_path, req['Sample'], req['tree'])
             delivery_info = (f"  {req['Sample']} | "
@@ -57,51 +69,409 @@ class OutputHandler():
             delivery_info = (f"  {req['Sample']} | "
                              f"{str(req['dataset'])[:100]}")
 
-        if delivery_setting == 1 or delivery_setting == 2:
-            if target_path.exists():
-                servicex_files = {Path(file).name for file in files}
-                local_files = {
-                    Path(file).name for file in list(target_path.glob("*"))
-                    }
-                servicex_data_path = Path(files[0]).parents[0]
-                # one RucioDID for this sample and files are already there
-                if servicex_files == local_files:
-                    log.info(f"{delivery_info} is already delivered")
-                else:
-                    # copy files in servicex but not in local
-                    files_not_in_local = servicex_files.difference(local_files)
-                    if files_not_in_local:
-                        for file in files_not_in_local:
-                            copy(Path(servicex_data_path, file),
-                                 Path(target_path, file))
-                        log.info(f"{delivery_info} is delivered")
-                    else:
-                        log.info(f"{delivery_info} is already delivered")
+        if delivery_setting in [1, 2, 7, 8]:
+            # LocalLink delivery links instead of copying
+            if delivery_setting == 7 or delivery_setting == 8:
+                transfer = self.copy_engine.link_files
             else:
+                transfer = self.copy_engine.copy_files
+            req_hash = request_hash(req, self._config)
+            servicex_files = {Path(file).name: file for file in files}
+            delivered = self.manifest.delivered_files(req_hash)
+            if not delivered and self.manifest.is_new \
+                    and target_path.exists():
+                # No manifest yet - adopt files delivered by older versions
+                delivered = self._adopt_local_files(
+                    req_hash, req, target_path, servicex_files
+                    )
+            # Copies cut short keep their name but not their size
+            incomplete = [
+                name for name, rel in delivered.items()
+                if name in servicex_files
+                and rel == self.manifest.relative(Path(target_path, name))
+                and not self.manifest.matches(Path(target_path, name))
+                ]
+            if incomplete:
+                log.warning(f"{delivery_info} - {len(incomplete)} "
+                            "incomplete file(s) are copied again")
+                for name in incomplete:
+                    Path(target_path, name).unlink(missing_ok=True)
+            files_not_in_local = [name for name in servicex_files
+                                  if name not in delivered
+                                  or name in incomplete]
+            if files_not_in_local:
                 target_path.mkdir(parents=True, exist_ok=True)
-                for file in files:
-                    outfile = Path(target_path, Path(file).name)
-                    copy(file, outfile)
+                nbytes = transfer(
+                    (servicex_files[name], Path(target_path, name))
+                    for name in files_not_in_local)
                 log.info(f"{delivery_info} is delivered")
+                log.debug(f"{delivery_info} - copied {nbytes / 1e6:.1f} MB")
+            else:
+                log.info(f"{delivery_info} is already delivered")
+            self.manifest.record(
+                req_hash, req, target_path, files_not_in_local,
+                cache_key(req, self._config)
+                )
+            self.manifest.retain(req_hash, servicex_files.keys())
         elif delivery_setting == 3 or delivery_setting == 4:
             log.info(f"{delivery_info} is cached locally")
         elif delivery_setting == 5 or delivery_setting == 6:
             log.info(f"{delivery_info} is available at the object store")
 
+    def copy_file_to_target(self, delivery_setting, req, file) -> Path:
+        """
+        Copy (or link) one file as soon as it is streamed from ServiceX
+        - blocking, run it in an executor from the event loop.
+        The request is recorded as complete by copy_to_target().
+        """
+        if req['codegen'] == "uproot":
+            target_path = Path(self.output_path, req['Sample'], req['tree'])
+        else:
+            target_path = Path(self.output_path, req['Sample'])
+        req_hash = request_hash(req, self._config)
+        name = Path(file).name
+        path = Path(target_path, name)
+        delivered = self.manifest.delivered_files(req_hash)
+        # a copy cut short keeps its name but not its size
+        incomplete = name in delivered \
+            and delivered[name] == self.manifest.relative(path) \
+            and not self.manifest.matches(path)
+        if incomplete:
+            log.warning(f"{path} is incomplete and copied again")
+            path.unlink(missing_ok=True)
+        if name not in delivered or incomplete:
+            target_path.mkdir(parents=True, exist_ok=True)
+            if delivery_setting == 7 or delivery_setting == 8:
+                self.copy_engine.link_files([(file, path)])
+            else:
+                self.copy_engine.copy_files([(file, path)])
+            self.manifest.record(req_hash, req, target_path, [name])
+        return path
+
+    def fan_out(self, delivery_setting, req, dup, files):
+        """
+        Give the delivered files of a request to a Sample which made
+        the same request - hard links in its directory instead of
+        another transfer. Blocking, run it in an executor.
+        """
+        if delivery_setting not in [1, 2, 7, 8]:
+            self.update_output_paths_dict(dup, files, delivery_setting)
+            return
+        if dup['codegen'] == "uproot":
+            target_path = Path(self.output_path, dup['Sample'], dup['tree'])
+            delivery_info = f"  {dup['Sample']} | {dup['tree']}"
+        else:
+            target_path = Path(self.output_path, dup['Sample'])
+            delivery_info = f"  {dup['Sample']}"
+        dup_hash = request_hash(dup, self._config)
+        sources = {Path(path).name: path for path in self.delivered_paths(req)}
+        delivered = self.manifest.delivered_files(dup_hash)
+        names = [name for name in sources if name not in delivered]
+        if names:
+            target_path.mkdir(parents=True, exist_ok=True)
+            self.copy_engine.link_files(
+                (sources[name], Path(target_path, name)) for name in names)
+            log.info(f"{delivery_info} is delivered "
+                     f"(same request as {req['Sample']})")
+        else:
+            log.info(f"{delivery_info} is already delivered")
+        self.manifest.record(dup_hash, dup, target_path, names,
+                             cache_key(dup, self._config))
+        self.manifest.retain(dup_hash, sources.keys())
+        self.index_files(dup)
+        self.update_output_paths_dict(dup, files, delivery_setting)
+
+    def chunk_plan(self, chunk_size: int) -> Dict[str, Any]:
+        """
+        (file, entry_start, entry_stop) steps of chunk_size entries for the
+        files in the catalog. Files without metadata are read in parallel.
+        """
+        def relative(path):
+            try:
+                return self.manifest.relative(path)
+            except ValueError:
+                # e.g. files of LocalPath Samples
+                return None
+
+        metadata = dict(self.catalog.metadata)
+        missing = {}
+        for _, tree, paths in self.catalog:
+            for path in paths:
+                if path in metadata:
+                    continue
+                rel = relative(path)
+                if rel is not None and self.manifest.file_metadata(rel):
+                    metadata[path] = self.manifest.file_metadata(rel)
+                elif Path(path).is_file():
+                    missing[path] = tree
+        read = self.copy_engine.map(lambda item: read_metadata(*item),
+                                    missing.items())
+        metadata.update(zip(missing, read))
+        self.manifest.set_file_metadata({
+            relative(path): metadata[path] for path in missing
+            if relative(path) is not None
+            })
+        return chunk_plan(self.catalog, metadata, chunk_size)
+
+    def index_files(self, req):
+        """
+        Checksums and metadata of the delivered files of a request
+        - blocking, run it in an executor
+        """
+        self.collect_checksums(req)
+        self.collect_metadata(req)
+
+    def collect_checksums(self, req):
+        """
+        With Checksum, record the checksum of the delivered files of
+        a request which have none in the manifest yet, on the copy threads
+        """
+        algorithm = self._config['General'].get('Checksum')
+        if not algorithm:
+            return
+        delivered = self.manifest.delivered_files(
+            request_hash(req, self._config)
+            )
+        rels = [rel for rel in dict.fromkeys(delivered.values())
+                if 'checksum' not in self.manifest.files.get(rel, {})]
+        checksums = self.copy_engine.map(
+            lambda rel: file_checksum(Path(self.output_path, rel), algorithm),
+            rels
+            )
+        self.manifest.set_checksums(dict(zip(rels, checksums)))
+
+    def collect_metadata(self, req):
+        """
+        With FileMetadata, read rows, layout and schema of the delivered
+        files of a request which have no metadata in the manifest yet,
+        on the copy threads - blocking, run it in an executor
+        """
+        if not self._config['General'].get('FileMetadata'):
+            return
+        tree = req['tree'] if req['codegen'] == "uproot" else None
+        delivered = self.manifest.delivered_files(
+            request_hash(req, self._config)
+            )
+        rels = [rel for rel in dict.fromkeys(delivered.values())
+                if self.manifest.file_metadata(rel) is None]
+        metadata = self.copy_engine.map(
+            lambda rel: read_metadata(Path(self.output_path, rel), tree),
+            rels
+            )
+        self.manifest.set_file_metadata(dict(zip(rels, metadata)))
+
+    def _result_cache_files(self, req, delivery_setting):
+        ttl = self._config['General'].get('ResultCacheTTL')
+        if delivery_setting not in [1, 2, 7, 8] or ttl == 0 \
+                or self._config['General'].get('IgnoreServiceXCache'):
+            return None
+        return self.manifest.cached_files(
+            request_hash(req, self._config),
+            cache_key(req, self._config),
+            ttl
+            )
+
+    def is_cached(self, req, delivery_setting) -> bool:
+        """
+        Whether the result cache serves a request
+        """
+        return self._result_cache_files(req, delivery_setting) is not None
+
+    def cached_request_files(self, req, delivery_setting):
+        """
+        Return delivered files of a request from the result cache,
+        or None if the request has to go to ServiceX
+        """
+        files = self._result_cache_files(req, delivery_setting)
+        if files is not None:
+            if req['codegen'] == "uproot":
+                log.info(f"  {req['Sample']} | {req['tree']} | "
+                         f"{str(req['dataset'])[:100]} is already delivered "
+                         "(result cache)")
+            else:
+                log.info(f"  {req['Sample']} | {str(req['dataset'])[:100]} "
+                         "is already delivered (result cache)")
+        return files
+
+    def _adopt_local_files(self, req_hash, req, target_path, servicex_files):
+        """
+        Index files that are already in the target directory with the
+        same name and size as the ServiceX files
+        """
+        names = [name for name, file in servicex_files.items()
+                 if Path(target_path, name).is_file()
+                 and Path(target_path, name).stat().st_size
+                 == Path(file).stat().st_size]
+        if names:
+            self.manifest.record(req_hash, req, target_path, names)
+        return self.manifest.delivered_files(req_hash)
+
     def parquet_to_root(self, tree_name, pq_file, root_file):
         """
         Write ROOT ntuple from parquet file
         """
-        if pq.read_metadata(pq_file).num_rows == 0:
-            pass
+        converter.parquet_to_root(
+            tree_name, pq_file, root_file,
+            self._config['General'].get('ConvertMaxMemory',
+                                        converter.DEFAULT_MAX_MEMORY)
+            )
+
+    def sample_to_root(self, sample: str) -> Dict[str, Any]:
+        """
+        Convert all delivered parquet files of a Sample to ROOT ntuples
+        in parallel. ROOT files are written next to the parquet files.
+        Returns the paths of the ROOT files in the same layout as
+        out_paths_dict[sample].
+        """
+        paths = self.out_paths_dict[sample]
+        trees = paths if isinstance(paths, dict) else {sample: paths}
+        jobs = [(tree, f, str(Path(f).with_suffix('.root')))
+                for tree, files in trees.items() for f in files
+                if Path(f).suffix == '.parquet']
+        converted = converter.bulk_parquet_to_root(
+            jobs,
+            self._config['General'].get('ConvertMaxMemory',
+                                        converter.DEFAULT_MAX_MEMORY),
+            self._config['General'].get('ConvertWorkers')
+            )
+        root_files = {job[1]: job[2]
+                      for job, done in zip(jobs, converted) if done}
+        out = {tree: [root_files[f] for f in files if f in root_files]
+               for tree, files in trees.items()}
+        return out if isinstance(paths, dict) else out[sample]
+
+    def _conversion_jobs(self, req) -> List[Dict[str, Any]]:
+        general = self._config['General']
+        suffix = converter.SUFFIXES[general['ConvertTo']]
+        if general['ConvertTo'] == 'root':
+            tree = req['tree'] if req['codegen'] == "uproot" else "servicex"
         else:
-            outfile = uproot.recreate(root_file)
-            tree_dict = {}
-            ak_arr = ak.from_parquet(pq_file)
-            for field in ak_arr.fields:
-                tree_dict[field] = ak_arr[field]
-            outfile[tree_name] = tree_dict
-            outfile.close()
+            tree = req['tree'] if req['codegen'] == "uproot" else None
+        delivered = self.manifest.delivered_files(
+            request_hash(req, self._config)
+            )
+        jobs = []
+        for rel in dict.fromkeys(delivered.values()):
+            source = Path(self.output_path, rel)
+            if source.suffix == suffix:
+                continue
+            jobs.append({
+                'source': str(source),
+                'target': str(source.with_suffix(suffix)),
+                'to': general['ConvertTo'],
+                'tree': tree,
+                'max_memory': general.get('ConvertMaxMemory',
+                                          converter.DEFAULT_MAX_MEMORY),
+                'compression': general.get('ConvertCompression'),
+                'row_group_size': general.get('ConvertRowGroupSize')
+                })
+        return jobs
+
+    async def convert_request(self, req):
+        """
+        Convert delivered files of a request to General.ConvertTo format
+        on a process pool, replacing them in the OutputDirectory
+        """
+        import asyncio
+        jobs = self._conversion_jobs(req)
+        if not jobs:
+            return
+        loop = asyncio.get_running_loop()
+        converted = await asyncio.gather(*[
+            loop.run_in_executor(self._get_process_pool(),
+                                 converter.convert_file, job)
+            for job in jobs])
+        for job, done in zip(jobs, converted):
+            # empty files are kept in the delivered format
+            if done:
+                self.manifest.replace_files(
+                    [self.manifest.relative(job['source'])], job['target']
+                    )
+                Path(job['source']).unlink()
+        log.debug(f"  {req['Sample']} | {req['tree']} - converted "
+                  f"{sum(converted)} file(s) to "
+                  f"{self._config['General']['ConvertTo']}")
+
+    def _merge_jobs(self, req) -> List[Dict[str, Any]]:
+        req_hash = request_hash(req, self._config)
+        delivered = self.manifest.delivered_files(req_hash)
+        names = {}
+        for name, rel in delivered.items():
+            names.setdefault(rel, []).append(name)
+        merged = [rel for rel in names
+                  if 'sources' in self.manifest.files[rel]]
+        candidates = [rel for rel in names if rel not in merged]
+
+        target_size = compaction.parse_size(
+            self._config['General']['MergeTargetSize']
+            )
+        jobs = []
+        for suffix in dict.fromkeys(Path(rel).suffix for rel in candidates):
+            files = [(rel, self.manifest.files[rel]['size'])
+                     for rel in candidates if Path(rel).suffix == suffix]
+            for group in compaction.plan_merges(files, target_size):
+                if len(group) < 2:
+                    continue
+                target = Path(
+                    self.output_path, Path(group[0]).parent,
+                    f"{req_hash[:8]}_merged_{len(merged):04d}{suffix}"
+                    )
+                merged.append(self.manifest.relative(target))
+                jobs.append({
+                    'sources': [str(Path(self.output_path, rel))
+                                for rel in group],
+                    'source_names': [name for rel in group
+                                     for name in names[rel]],
+                    'target': str(target),
+                    'tree': req['tree'] if req['codegen'] == "uproot"
+                    else None
+                    })
+        return jobs
+
+    async def merge_request(self, req):
+        """
+        Merge small delivered files of a request into files of up to
+        General.MergeTargetSize on a process pool
+        """
+        import asyncio
+        jobs = self._merge_jobs(req)
+        if not jobs:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._get_process_pool(),
+                                 compaction.merge_files, job)
+            for job in jobs])
+        for job in jobs:
+            self.manifest.replace_files(
+                [self.manifest.relative(f) for f in job['sources']],
+                job['target'], sources=job['source_names']
+                )
+            for f in job['sources']:
+                Path(f).unlink()
+        log.debug(f"  {req['Sample']} | {req['tree']} - merged "
+                  f"{sum(len(job['sources']) for job in jobs)} file(s) "
+                  f"into {len(jobs)} file(s)")
+
+    def merged_sources(self) -> Dict[str, List[str]]:
+        """
+        Merged file path -> ServiceX files it was merged from
+        """
+        return {str(Path(self.output_path, rel)): info['sources']
+                for rel, info in self.manifest.files.items()
+                if 'sources' in info}
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self._config['General'].get('ConvertWorkers')
+                )
+        return self._process_pool
+
+    def close(self):
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
 
     def update_output_paths_dict(
             self,
@@ -110,37 +480,36 @@ class OutputHandler():
             delivery_setting: int
             ):
         """
-        Update dictionary of outfile paths
+        Add outfile paths of a request to the catalog
         """
-        if req['codegen'] == "uproot":
-            target_path = Path(self.output_path, req['Sample'], req['tree'])
-            paths_in_output_dict = \
-                self.out_paths_dict[req['Sample']][req['tree']]
-        elif req['codegen'] == "atlasr21" or req['codegen'] == "python":
-            target_path = Path(self.output_path, req['Sample'])
-            paths_in_output_dict = self.out_paths_dict[req['Sample']]
-
-        # Update file path if deliver to localpath
-        if delivery_setting == 1 or delivery_setting == 2:
-            new_files = [
-                str(Path(target_path, Path(file).name))
-                for file in files
-                ]
+        # Update file path if deliver to localpath or locallink
+        # - delivered (and converted) files from the manifest
+        if delivery_setting in [1, 2, 7, 8]:
+            new_files = self.delivered_paths(req)
         elif delivery_setting == 5 or delivery_setting == 6:
             new_files = [file._url for file in files]
         else:
             new_files = [str(file) for file in files]
 
-        # Update output_dict
-        if paths_in_output_dict:
-            output_dict = list(set(paths_in_output_dict + new_files))
-        else:
-            output_dict = new_files
+        tree = req['tree'] if req['codegen'] == "uproot" else None
+        self.catalog.add(req['Sample'], tree, new_files)
+        if delivery_setting in [1, 2, 7, 8] \
+                and self._config['General'].get('FileMetadata'):
+            self.catalog.add_metadata({
+                path: self.manifest.file_metadata(
+                    self.manifest.relative(path))
+                for path in new_files
+                })
 
-        if req['codegen'] == "uproot":
-            self.out_paths_dict[req['Sample']][req['tree']] = output_dict
-        elif req['codegen'] == "atlasr21" or req['codegen'] == "python":
-            self.out_paths_dict[req['Sample']] = output_dict
+    def delivered_paths(self, req) -> List[str]:
+        """
+        Paths of the delivered (and converted or merged) files of a request
+        """
+        delivered = self.manifest.delivered_files(
+            request_hash(req, self._config)
+            )
+        return [str(Path(self.output_path, rel))
+                for rel in dict.fromkeys(delivered.values())]
 
     def add_local_output_paths_dict(self):
         local_samples = [sample for sample in self._config.get('Sample')
@@ -151,68 +520,174 @@ class OutputHandler():
                                        sample['LocalPath'].split(',')):
                     tree = tree.strip()
                     fpath = fpath.strip()
-                    self.out_paths_dict[sample['Name']][tree] \
-                        = [str(Path(f)) for f in Path(fpath).glob("*")]
+                    self.catalog.replace(
+                        sample['Name'], tree,
+                        [str(Path(f)) for f in Path(fpath).glob("*")]
+                        )
                     log.info(f"  {sample['Name']} "
                              f"| {tree} | {fpath} is from local path")
             else:
                 for fpath in sample['LocalPath'].split(','):
                     fpath = fpath.strip()
-                    self.out_paths_dict[sample['Name']] = \
+                    self.catalog.replace(
+                        sample['Name'], None,
                         [str(Path(f)) for f in Path(fpath).glob("*")]
+                        )
                     log.info(f"  {sample['Name']} "
                              f"| {fpath} is from local path")
 
-    def write_output_paths_dict(self, out_paths_dict):
+    def write_output_paths_dict(self):
         """
-        Write yaml of output paths
+        Write the output paths catalog in the OutputDictFormat(s)
         """
+        written = []
         if 'WriteOutputDict' in self._config['General'].keys():
-            file_out_paths = \
-                (f"{self.output_path}/"
-                 f"{self._config['General']['WriteOutputDict']}.yml")
-            with open(file_out_paths, 'w') as f:
-                log.debug("YAML file containing delivered file paths: "
-                          f"{f.name}")
-                yaml.dump(out_paths_dict, f, default_flow_style=False)
-            log.info("YAML file containing delivered file paths: "
-                     f"{file_out_paths}")
+            formats = self._config['General'].get('OutputDictFormat', 'yaml')
+            if not isinstance(formats, list):
+                formats = [formats]
+            stem = Path(self.output_path,
+                        self._config['General']['WriteOutputDict'])
+            for fmt in FORMATS:
+                if fmt not in formats:
+                    stem.with_suffix(FORMATS[fmt]).unlink(missing_ok=True)
+            for fmt in formats:
+                file_out_paths = self.catalog.write(stem, fmt)
+                written.append(file_out_paths)
+                log.info("Output dictionary containing delivered file "
+                         f"paths: {file_out_paths}")
+            chunks_path = Path(f"{stem}_chunks.json")
+            if self._config['General'].get('ChunkSize'):
+                chunks_path.write_text(json.dumps(
+                    self.chunk_plan(self._config['General']['ChunkSize'])
+                    ))
+                written.append(chunks_path)
+                log.info(f"Chunk plan: {chunks_path}")
+            else:
+                chunks_path.unlink(missing_ok=True)
+            metadata_path = Path(f"{stem}_metadata.json")
+            if self._config['General'].get('FileMetadata'):
+                self.catalog.write_metadata(metadata_path)
+                written.append(metadata_path)
+                log.info(f"File metadata: {metadata_path}")
+            else:
+                metadata_path.unlink(missing_ok=True)
         else:
             for yl in list(Path(self.output_path).glob("*yml")):
                 Path.unlink(yl)
+        # output dictionaries which earlier deliveries wrote under
+        # another name or format
+        written = [os.path.relpath(path, self.output_path)
+                   for path in written]
+        for rel in self.manifest.outputs:
+            if rel not in written:
+                Path(self.output_path, rel).unlink(missing_ok=True)
+        self.manifest.outputs = written
 
-    def clean_up_files_not_in_requests(self, out_paths_dict):
+    def clean_up_files_not_in_requests(self, out_paths_dict,
+                                       dry_run: bool = False
+                                       ) -> Dict[str, List[str]]:
+        """
+        Remove Samples, Trees and delivered files which are not in the
+        requests in one pass over the manifest, deleting on a thread pool.
+        Returns the removed (with dry_run, the stale) Sample and Tree
+        directories and files relative to the OutputDirectory.
+        """
+        expected = set()
+        for paths in out_paths_dict.values():
+            for tree_paths in (paths.values() if isinstance(paths, dict)
+                               else [paths]):
+                expected.update(tree_paths)
 
-        samples_in_requests = list(out_paths_dict.keys())
-        samples_local = [sa.name for sa in self.output_path.iterdir()
-                         if sa.is_dir()]
-        for sample in samples_local:
-            if not (sample in samples_in_requests):
-                rmtree(Path(self.output_path, sample))
-            else:
-                if list(Path(self.output_path, sample).iterdir())[0].is_dir():
-                    for tree in out_paths_dict[sample].keys():
-                        for tree in [tr.name for tr in
-                                     Path(self.output_path, sample).iterdir()
-                                     if tr.is_dir()]:
-                            if tree in out_paths_dict[sample].keys():
-                                files_local = set(Path(self.output_path,
-                                                       sample, tree).glob("*"))
-                                files_request = set(
-                                    [Path(item)
-                                     for item in out_paths_dict[sample][tree]]
-                                    )
-                                for tbd in \
-                                        files_local.difference(files_request):
-                                    Path.unlink(tbd)
-                            else:
-                                rmtree(Path(self.output_path, sample, tree))
-                else:
-                    files_local = set(Path(self.output_path, sample).glob("*"))
-                    files_request = set(
-                        [Path(item) for item in out_paths_dict[sample]]
-                        )
-                    for tbd in files_local.difference(files_request):
-                        Path.unlink(tbd)
+        stale_samples = [sa for sa in self.output_path.iterdir()
+                         if sa.is_dir() and sa.name not in out_paths_dict]
+        stale_trees = []
+        directories = []
+        for sample, paths in out_paths_dict.items():
+            sample_path = Path(self.output_path, sample)
+            if not sample_path.is_dir():
+                continue
+            if not isinstance(paths, dict):
+                directories.append(sample_path)
+                continue
+            for tree in sample_path.iterdir():
+                if tree.is_dir():
+                    if tree.name in paths:
+                        directories.append(tree)
+                    else:
+                        stale_trees.append(tree)
+        stale_files = [rel for rel in self.manifest.tracked_files()
+                       if str(Path(self.output_path, rel)) not in expected]
+        if self.manifest.is_new:
+            # No manifest yet - files of older versions are not tracked
+            stale_files += [
+                self.manifest.relative(path) for directory in directories
+                for path in directory.iterdir()
+                if path.is_file() and str(path) not in expected
+                and self.manifest.relative(path) not in self.manifest.files
+                ]
+        report = {'samples': [sa.name for sa in stale_samples],
+                  'trees': [self.manifest.relative(tree)
+                            for tree in stale_trees],
+                  'files': stale_files}
+        if dry_run:
+            log.info(f"Clean-up would remove {len(stale_samples)} Sample(s), "
+                     f"{len(stale_trees)} Tree(s) "
+                     f"and {len(stale_files)} file(s)")
+            return report
+
+        # files of removed Sample and Tree directories go with the directory
+        removed = set(report['samples'] + report['trees'])
+        with ThreadPoolExecutor(
+                max_workers=self.copy_engine.workers) as executor:
+            list(executor.map(rmtree, stale_samples + stale_trees))
+            list(executor.map(
+                lambda rel: Path(self.output_path, rel).unlink(
+                    missing_ok=True),
+                [rel for rel in stale_files
+                 if Path(rel).parts[0] not in removed
+                 and Path(*Path(rel).parts[:2]).as_posix() not in removed]
+                ))
+        self.manifest.forget_files(stale_files)
+
+        # Remove Tree directories left empty
+        for rel in {str(Path(rel).parent) for rel in stale_files}:
+            directory = Path(self.output_path, rel)
+            if directory.is_dir() and directory != self.output_path \
+                    and not any(directory.iterdir()):
+                directory.rmdir()
+        self.manifest.save()
+        if stale_samples or stale_trees or stale_files:
+            log.debug(f"Removed {len(stale_samples)} Sample(s), "
+                      f"{len(stale_trees)} Tree(s) and "
+                      f"{len(stale_files)} file(s) not in the requests")
+        return report
+
+    def start_clean_up(self, out_paths_dict,
+                       dry_run: bool = False) -> 'CleanupHandle':
+        """
+        Run clean_up_files_not_in_requests() in a background thread
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.clean_up_files_not_in_requests,
+                                 out_paths_dict, dry_run)
+        executor.shutdown(wait=False)
+        return CleanupHandle(future)
+
+
+class CleanupHandle():
+    """
+    Clean-up running in the background - join() it, or await it in
+    a coroutine, for the report of removed Samples and files
+    """
+
+    def __init__(self, future: Future) -> None:
+        self._future = future
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def join(self, timeout: float = None) -> Dict[str, List[str]]:
+        return self._future.result(timeout)
 
-        return
+    def __await__(self):
+        return asyncio.wrap_future(self._future).__await__()
@@ -0,0 +1,193 @@
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+import ast
+import hashlib
+import itertools
+import json
+import linecache
+import os
+
+import logging
+log = logging.getLogger(__name__)
+
+QUERY_CACHE_NAME = "queries.json"
+# translators whose versions invalidate the on-disk cache
+_TRANSLATORS = ['tcut_to_qastle', 'qastle', 'func_adl', 'func_adl_servicex']
+_source_id = itertools.count()
+# fewer queries to compile are not worth starting a process pool
+PARALLEL_MIN_QUERIES = 256
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                Path(Path.home(), '.cache'))
+    return Path(cache_home, 'servicex_databinder')
+
+
+def _translator_versions() -> Dict[str, str]:
+    from importlib import metadata
+    versions = {}
+    for name in _TRANSLATORS:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def columns_to_qastle(tree: str, columns: str, selection: str) -> str:
+    import tcut_to_qastle as tq
+    return tq.translate(tree, columns, selection)
+
+
+def funcadl_to_qastle(tree: str, funcadl: str) -> str:
+    import qastle
+    query = f"EventDataset('ServiceXDatasetSource', '{tree}')." + funcadl
+    return qastle.python_ast_to_text_ast(
+        qastle.insert_linq_nodes(ast.parse(query)))
+
+
+class _QueryOnlyDataset():
+    """
+    Stands in for the ServiceXDataset of a func-adl source, which is
+    never executed when only the query is compiled
+    """
+
+
+def xaod_funcadl_to_qastle(funcadl: str) -> str:
+    """
+    Compile a func-adl query on ServiceXSourceXAOD without creating
+    a ServiceXDataset. The source is registered in linecache so that
+    func-adl can read the lambdas back.
+    """
+    import qastle
+    from func_adl_servicex import ServiceXSourceXAOD
+
+    source = "ServiceXSourceXAOD(_QueryOnlyDataset())." + funcadl
+    filename = f"<servicex-databinder-query-{next(_source_id)}>"
+    linecache.cache[filename] = (len(source), None, [source + "\n"],
+                                 filename)
+    try:
+        o = eval(compile(source, filename, "eval"), {
+            'ServiceXSourceXAOD': ServiceXSourceXAOD,
+            '_QueryOnlyDataset': _QueryOnlyDataset
+            })
+    finally:
+        linecache.cache.pop(filename, None)
+    return qastle.python_ast_to_text_ast(o._q_ast)
+
+
+_COMPILERS = {
+    'columns': columns_to_qastle,
+    'funcadl': funcadl_to_qastle,
+    'xaod-funcadl': xaod_funcadl_to_qastle,
+    }
+
+
+def _key(kind: str, *query: str) -> str:
+    return hashlib.sha1(json.dumps([kind, *query]).encode("utf-8")).hexdigest()
+
+
+def _compile_job(spec: Tuple[str, ...]) -> Union[str, None]:
+    """
+    Compile one query on a process pool - None if it fails, so that
+    the error is raised (and logged) when the request is built
+    """
+    try:
+        return _COMPILERS[spec[0]](*spec[1:])
+    except Exception:
+        return None
+
+
+class QueryCompiler():
+    """
+    Memoized translation of queries to qastle keyed by (kind, query text),
+    with an on-disk cache across runs. The on-disk cache is dropped when
+    a translator package changes version.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path, None] = None) -> None:
+        self.path = None
+        if cache_dir is not None:
+            self.path = Path(cache_dir, QUERY_CACHE_NAME)
+        self._versions = None
+        # (kind, *query) -> qastle, and hash of (kind, *query) -> qastle
+        # as stored on disk
+        self._memo = {}
+        self._queries = {}
+        self._dirty = False
+        self.hits = 0
+        self.load()
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            content = json.loads(self.path.read_text())
+            if content['versions'] == self.versions:
+                self._queries = content['queries']
+        except Exception as e:
+            log.debug(f"Ignoring unreadable query cache {self.path}: {e!r}")
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({'versions': self.versions,
+                                       'queries': self._queries}))
+            os.replace(tmp, self.path)
+            self._dirty = False
+        except OSError as e:
+            log.debug(f"Cannot write query cache {self.path}: {e!r}")
+
+    @property
+    def versions(self) -> Dict[str, Any]:
+        if self._versions is None:
+            self._versions = _translator_versions()
+        return self._versions
+
+    def compile(self, kind: str, *query: str) -> str:
+        """
+        qastle of a query - kind is columns (tree, columns, selection),
+        funcadl (tree, func-adl) or xaod-funcadl (func-adl)
+        """
+        spec = (kind, *query)
+        if spec in self._memo:
+            self.hits += 1
+            return self._memo[spec]
+        key = _key(*spec)
+        if key in self._queries:
+            self.hits += 1
+        else:
+            self._queries[key] = _COMPILERS[kind](*query)
+            self._dirty = True
+        self._memo[spec] = self._queries[key]
+        return self._memo[spec]
+
+    def compile_many(self, specs: Iterable[Tuple[str, ...]],
+                     workers: int = None):
+        """
+        Compile the queries (kind, *query) which are not cached yet on
+        a process pool, so that compile() finds them in the memo
+        """
+        missing = {}
+        for spec in set(specs).difference(self._memo):
+            key = _key(*spec)
+            if key not in self._queries:
+                missing[key] = spec
+        workers = workers or os.cpu_count() or 1
+        if len(missing) < PARALLEL_MIN_QUERIES or workers == 1:
+            return
+        log.debug(f"Compile {len(missing)} queries on {workers} processes")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            compiled = pool.map(
+                _compile_job, missing.values(),
+                chunksize=max(len(missing) // (4 * workers), 1)
+                )
+            for key, qastle_query in zip(missing, compiled):
+                if qastle_query is not None:
+                    self._queries[key] = qastle_query
+                    self._dirty = True
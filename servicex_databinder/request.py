@@ -1,35 +1,96 @@
-from typing import Any, Dict, List
-import tcut_to_qastle as tq
-import qastle
-import ast
+from typing import Any, Callable, Dict, Iterator, List
 import logging
 from base64 import b64encode
-from func_adl_servicex import ServiceXSourceXAOD # NOQA
-from servicex import ServiceXDataset # NOQA
+
+from .did_resolver import RucioDIDResolver
+from .query_compiler import QueryCompiler, default_cache_dir
 
 log = logging.getLogger(__name__)
 
 
+def request_key(req: Dict) -> tuple:
+    """
+    Canonical form of a request - identical transforms have the same key
+    """
+    dataset = req['dataset']
+    if isinstance(dataset, list):
+        dataset = tuple(sorted(dataset))
+    return (dataset, req['tree'], req['type'], req['codegen'], req['query'])
+
+
 class ServiceXRequest():
     """
     Prepare ServiceX requests
     """
-    def __init__(self, config: Dict[str, Any]) -> None:
+    def __init__(self, config: Dict[str, Any],
+                 did_resolver: Callable[[str], List[str]] = None) -> None:
         self._config = config
+        self._did_resolver = did_resolver
+        query_cache = config['General'].get('QueryCache', True)
+        self._compiler = QueryCompiler(
+            default_cache_dir() if query_cache is True
+            else query_cache or None
+            )
 
     def get_requests(self) -> List:
         log.debug(f"ServiceX backend: "
                   f"{self._config.get('General')['ServiceXName']}")
+        # Compile the distinct queries of all Samples in parallel first
+        self._compiler.compile_many(
+            spec for sample in self._config.get('Sample')
+            for tree in self._trees(sample)
+            for spec in [self._query_spec(sample, tree)] if spec
+            )
         list_requests = []
         for sample in self._config.get('Sample'):
             list_requests.append(self._build_request(sample))
         # flatten nested lists
         flist_requests = [request for x in list_requests for request in x]
+        flist_requests = self._deduplicate(flist_requests)
+        self._compiler.save()
+        log.debug(f"{self._compiler.hits} queries from the query cache")
         log.debug("number of total ServiceX requests in the config: "
                   f"{len(flist_requests)}")
-        log.debug(f"ServiceX requests in the config: {flist_requests}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"ServiceX requests in the config: {flist_requests}")
         return flist_requests
 
+    def iter_requests(self) -> Iterator[Dict]:
+        """
+        Build requests Sample by Sample, higher Priority first, and yield
+        them as soon as they are built (pipelined delivery). Identical
+        requests are deduplicated by the consumer.
+        """
+        samples = sorted(self._config.get('Sample'),
+                         key=lambda sample: -sample.get('Priority', 0))
+        try:
+            for sample in samples:
+                yield from self._build_request(sample)
+        finally:
+            self._compiler.save()
+
+    def _deduplicate(self, requests: List[Dict]) -> List[Dict]:
+        """
+        Submit identical requests (same dataset, tree, codegen and query)
+        once. Requests of other Samples are kept in 'fanout' of the
+        submitted request and get its result.
+        """
+        unique = {}
+        for req in requests:
+            primary = unique.setdefault(request_key(req), req)
+            if primary is req:
+                continue
+            if req['Sample'] == primary['Sample'] or any(
+                    req['Sample'] == other['Sample']
+                    for other in primary.get('fanout', [])):
+                log.debug(f"  Sample {req['Sample']} - dropped duplicated "
+                          "request")
+                continue
+            log.debug(f"  Sample {req['Sample']} - same request as Sample "
+                      f"{primary['Sample']}")
+            primary.setdefault('fanout', []).append(req)
+        return list(unique.values())
+
     def _build_request(self, sample: Dict) -> Dict:
         """
         Return a list containing ServiceX request(s) of the given sample
@@ -46,16 +107,21 @@ class ServiceXRequest():
                 trees = ['dummy']
                 log.debug(f"  Sample {sample['Name']} has {len(dids)} DID(s)")
 
+            datasets = [did.strip() for did in dids]
+            if 'MaxFilesPerRequest' in sample.keys():
+                datasets = [shard for did in datasets
+                            for shard in self._shard_did(sample, did)]
             for tree in trees:
-                for did in dids:
+                query = self._build_query(sample, tree.strip())
+                for dataset in datasets:
                     requests_sample.append(
                         {
                             'Sample': sample['Name'],
-                            'dataset': did.strip(),
+                            'dataset': dataset,
                             'type': sample['Type'],
                             'codegen': sample['Transformer'],
                             'tree': tree.strip(),
-                            'query': self._build_query(sample, tree.strip())
+                            'query': query
                         }
                     )
         elif 'XRootDFiles' in sample.keys():
@@ -70,67 +136,95 @@ class ServiceXRequest():
                 trees = ['dummy']
                 log.debug(f"  Sample {sample['Name']} has "
                           f"{len(xrootd_filelist)} file(s)")
+            shards = self._shard(sample, xrootd_filelist)
             for tree in trees:
-                requests_sample.append(
-                    {
-                        'Sample': sample['Name'],
-                        'dataset': xrootd_filelist,
-                        'type': sample['Type'],
-                        'codegen': sample['Transformer'],
-                        'tree': tree.strip(),
-                        'query': self._build_query(sample, tree)
-                    }
-                )
+                query = self._build_query(sample, tree)
+                for shard in shards:
+                    requests_sample.append(
+                        {
+                            'Sample': sample['Name'],
+                            'dataset': shard,
+                            'type': sample['Type'],
+                            'codegen': sample['Transformer'],
+                            'tree': tree.strip(),
+                            'query': query
+                        }
+                    )
         return requests_sample
 
-    def _build_query(self, sample: Dict, tree: str) -> str:
+    def _shard(self, sample: Dict, files: List[str]) -> List[List[str]]:
         """
-        Get query for each sample
-        Option Columns for TCut syntax
-        Option FuncADL for func-adl syntax
+        Split a file list into lists of at most MaxFilesPerRequest files
+        """
+        size = sample.get('MaxFilesPerRequest')
+        if not size or len(files) <= size:
+            return [files]
+        shards = [files[i:i + size] for i in range(0, len(files), size)]
+        log.debug(f"  Sample {sample['Name']} - {len(files)} files in "
+                  f"{len(shards)} requests")
+        return shards
+
+    def _shard_did(self, sample: Dict, did: str) -> List:
+        """
+        Resolve a DID to its files and shard them. The DID is requested
+        as a whole if it cannot be resolved.
+        """
+        if self._did_resolver is None:
+            self._did_resolver = RucioDIDResolver()
+        try:
+            files = self._did_resolver(did)
+        except Exception as e:
+            log.warning(f"Sample {sample['Name']} - cannot resolve {did} "
+                        f"({e!r}), requested without MaxFilesPerRequest")
+            return [did]
+        if len(files) <= sample['MaxFilesPerRequest']:
+            return [did]
+        return self._shard(sample, files)
+
+    def _trees(self, sample: Dict) -> List[str]:
+        """
+        Trees as passed to _build_query() by _build_request()
+        """
+        if 'LocalPath' in sample.keys():
+            return []
+        if sample['Transformer'] != "uproot":
+            return ['dummy']
+        if 'RucioDID' in sample.keys():
+            return [tree.strip() for tree in sample['Tree'].split(',')]
+        return sample['Tree'].split(',')
+
+    def _query_spec(self, sample: Dict, tree: str):
+        """
+        (kind, *query) of the query compiler for a Sample and Tree,
+        None if the query is not compiled
         """
         if sample['Transformer'] == "uproot":
             if 'Columns' in sample:
                 if ('Filter' not in sample) or (sample['Filter'] is None):
                     sample['Filter'] = ''
-                # else:
-                try:
-                    query = tq.translate(
-                        tree,
-                        sample['Columns'],
-                        sample['Filter']
-                    )
-                    return query
-                except Exception:
-                    log.exception(
-                        "Exception occured for the query "
-                        f"of Sample {sample['Name']}"
-                        )
+                return ('columns', tree, sample['Columns'], sample['Filter'])
             elif 'FuncADL' in sample:
-                query = ("EventDataset('ServiceXDatasetSource', "
-                         f"'{tree}')." + sample['FuncADL'])
-                try:
-                    qastle_query = qastle.python_ast_to_text_ast(
-                        qastle.insert_linq_nodes(ast.parse(query)))
-                    return qastle_query
-                except Exception:
-                    log.exception(
-                        "Exception occured for the query "
-                        f"of Sample {sample['Name']}"
-                        )
+                return ('funcadl', tree, sample['FuncADL'])
         elif sample['Transformer'] == "atlasr21":
-            query = "ServiceXSourceXAOD(ServiceXDataset('', backend_name='" \
-                + self._config.get('General')['ServiceXName'] + "'))." \
-                + sample['FuncADL']
-            try:
-                o = eval(query)
-                qastle_query = qastle.python_ast_to_text_ast(o._q_ast)
-                return qastle_query
-            except Exception:
-                log.exception(
-                    "Exception occured for the query "
-                    f"of Sample {sample['Name']}"
-                    )
-        elif sample['Transformer'] == "python":
+            return ('xaod-funcadl', sample['FuncADL'])
+        return None
+
+    def _build_query(self, sample: Dict, tree: str) -> str:
+        """
+        Get query for each sample
+        Option Columns for TCut syntax
+        Option FuncADL for func-adl syntax
+        """
+        if sample['Transformer'] == "python":
             query = sample['Function']
             return b64encode(query.encode("utf-8")).decode("utf-8")
+        spec = self._query_spec(sample, tree)
+        if spec is None:
+            return None
+        try:
+            return self._compiler.compile(*spec)
+        except Exception:
+            log.exception(
+                "Exception occured for the query "
+                f"of Sample {sample['Name']}"
+                )
@@ -0,0 +1,122 @@
+from typing import Any, Awaitable, Callable, Dict, Tuple, Union
+import asyncio
+import random
+import re
+
+import logging
+log = logging.getLogger(__name__)
+
+# Error class name -> policy. Errors of these classes are retried by
+# default if their cause is transient (see is_transient).
+DEFAULT_POLICY = {'MaxAttempts': 3, 'Backoff': 5., 'MaxBackoff': 120.}
+DEFAULT_RETRY_POLICIES = {
+    'ClientError': DEFAULT_POLICY,
+    'TimeoutError': DEFAULT_POLICY,
+    'ServiceXException': DEFAULT_POLICY,
+    }
+
+
+def retry_policies(config: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Retry policies from the Retry option of the General block merged
+    on top of the defaults. Retry: False disables retries.
+    """
+    retry = config['General'].get('Retry', {})
+    if retry is False:
+        return {}
+    policies = dict(DEFAULT_RETRY_POLICIES)
+    for error, policy in (retry or {}).items():
+        policies[error] = dict(DEFAULT_POLICY, **(policy or {}))
+    return policies
+
+
+# HTTP status in messages of ServiceXException, e.g. "rejected ...: (503)"
+_STATUS = re.compile(r"\((\d{3})\)")
+_CONNECTION_ERRORS = {'ClientConnectionError', 'ClientPayloadError',
+                      'ConnectionError', 'TimeoutError'}
+
+
+def _transient_status(status: int) -> bool:
+    return status >= 500 or status == 429
+
+
+def is_transient(error: BaseException) -> Union[bool, None]:
+    """
+    Classify an error by its cause: True if the backend is unavailable
+    (connection errors, timeouts, 5xx or 429 responses), False if the
+    error repeats when the request is repeated (rejected requests,
+    failed transforms), None if unknown
+    """
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & _CONNECTION_ERRORS:
+        return True
+    if 'ClientResponseError' in names \
+            and isinstance(getattr(error, 'status', None), int):
+        return _transient_status(error.status)
+    if 'ClientError' in names:
+        return False
+    if 'ServiceXException' in names:
+        match = _STATUS.search(str(error))
+        if match is not None:
+            return _transient_status(int(match.group(1)))
+        # e.g. "Failed to transform all files" from a failed file
+        cause = error.__cause__
+        return cause is not None and is_transient(cause) is True
+    return None
+
+
+def matched_policy(error: Exception,
+                   policies: Dict[str, Dict[str, float]]
+                   ) -> Union[Tuple[str, Dict[str, float]], None]:
+    """
+    Most specific error class (following the MRO) with a policy,
+    and its policy
+    """
+    for cls in type(error).__mro__:
+        if cls.__name__ in policies:
+            return cls.__name__, policies[cls.__name__]
+    return None
+
+
+def policy_for(error: Exception,
+               policies: Dict[str, Dict[str, float]]
+               ) -> Union[Dict[str, float], None]:
+    """
+    Policy of the most specific error class (following the MRO)
+    """
+    matched = matched_policy(error, policies)
+    return matched[1] if matched is not None else None
+
+
+def backoff_delay(attempt: int, policy: Dict[str, float]) -> float:
+    """
+    Exponential backoff with full jitter
+    """
+    cap = min(policy['MaxBackoff'], policy['Backoff'] * 2 ** (attempt - 1))
+    return random.uniform(0, cap)
+
+
+async def call_with_retry(func: Callable[[], Awaitable[Any]],
+                          policies: Dict[str, Dict[str, float]],
+                          description: str = "") -> Any:
+    """
+    Await func() and retry it according to the policy of the raised error.
+    Errors which repeat when the request is repeated are not retried.
+    Attempts are counted per error class.
+    """
+    failures = {}
+    while True:
+        try:
+            return await func()
+        except Exception as e:
+            matched = matched_policy(e, policies)
+            if matched is None or is_transient(e) is False:
+                raise
+            name, policy = matched
+            n = failures[name] = failures.get(name, 0) + 1
+            if n >= policy['MaxAttempts']:
+                raise
+            delay = backoff_delay(n, policy)
+            log.warning(f"{description} - {type(e).__name__}: retry "
+                        f"{n}/{policy['MaxAttempts'] - 1} in {delay:.0f} s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,118 @@
+from typing import Any, Callable, Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+log = logging.getLogger(__name__)
+
+POLICIES = ['sjf', 'fair', 'fifo']
+# concurrent Rucio lookups of the number of files of DIDs
+RUCIO_LOOKUP_WORKERS = 8
+
+
+class RequestScheduler():
+    """
+    Order ServiceX requests for submission: higher Sample Priority first,
+    then by policy within the same priority
+      sjf  - shortest job first, by the estimated number of input files
+      fair - round-robin over Samples, so that every Sample gets
+             an equal share of the concurrent requests
+      fifo - config order
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.policy = config['General'].get('SchedulePolicy', 'sjf').lower()
+        self.rucio_file_counts = config['General'].get('RucioFileCounts',
+                                                       False)
+        self._priority = {sample['Name']: sample.get('Priority', 0)
+                          for sample in config['Sample']}
+        self._rucio = None
+        self._sizes = {}
+
+    def priority(self, req: Dict[str, Any]) -> float:
+        # highest priority of the Samples sharing the request
+        return max(self._priority.get(r['Sample'], 0)
+                   for r in [req] + req.get('fanout', []))
+
+    def estimate_size(self, req: Dict[str, Any]) -> Union[int, None]:
+        """
+        Number of input files of a request: length of the XRootD file list,
+        or number of files of a Rucio DID looked up by look_up_sizes().
+        None if unknown.
+        """
+        if isinstance(req['dataset'], list):
+            return len(req['dataset'])
+        return self._sizes.get(req['dataset'])
+
+    def look_up_sizes(self, requests: List[Dict[str, Any]]):
+        """
+        Number of files of the Rucio DIDs of the requests, looked up
+        concurrently if RucioFileCounts is set and the rucio client
+        is available
+        """
+        dids = {req['dataset'] for req in requests
+                if not isinstance(req['dataset'], list)}.difference(
+                    self._sizes)
+        if not self.rucio_file_counts or not dids:
+            return
+        try:
+            if self._rucio is None:
+                from rucio.client import Client
+                self._rucio = Client()
+        except Exception as e:
+            log.debug(f"No rucio client ({e!r}) - requests of Rucio DIDs "
+                      "are scheduled after requests of known size")
+            self.rucio_file_counts = False
+            return
+        dids = list(dids)
+        with ThreadPoolExecutor(max_workers=min(
+                RUCIO_LOOKUP_WORKERS, len(dids))) as executor:
+            self._sizes.update(zip(dids, executor.map(
+                self._rucio_file_count, dids)))
+
+    def _rucio_file_count(self, did: str) -> Union[int, None]:
+        try:
+            scope, name = did.split(":")
+            return sum(1 for _ in self._rucio.list_files(scope, name))
+        except Exception as e:
+            log.debug(f"No file count for {did} ({e!r}) - "
+                      "scheduled after requests of known size")
+            return None
+
+    def order(self, requests: List[Dict[str, Any]],
+              cached: Callable[[Dict[str, Any]], bool] = None
+              ) -> List[Dict[str, Any]]:
+        """
+        Requests in submission order. Requests for which cached() is
+        True are served by the result cache and go first, without
+        looking up their size.
+        """
+        if self.policy == 'sjf':
+            is_cached = {id(req): cached is not None and cached(req)
+                         for req in requests}
+            self.look_up_sizes([req for req in requests
+                                if not is_cached[id(req)]])
+
+            def key(item):
+                _, req = item
+                size = 0 if is_cached[id(req)] else self.estimate_size(req)
+                # requests of unknown size go last within their priority
+                return (-self.priority(req), size is None, size or 0)
+        elif self.policy == 'fair':
+            # n-th request of a Sample goes in the n-th round
+            rank, sample_rank, counts = {}, {}, {}
+            for idx, req in enumerate(requests):
+                sample_rank.setdefault(req['Sample'], len(sample_rank))
+                rank[idx] = counts.get(req['Sample'], 0)
+                counts[req['Sample']] = rank[idx] + 1
+
+            def key(item):
+                idx, req = item
+                return (-self.priority(req), rank[idx],
+                        sample_rank[req['Sample']])
+        else:
+            def key(item):
+                return -self.priority(item[1])
+        ordered = [req for _, req in sorted(enumerate(requests), key=key)]
+        log.debug(f"Requests scheduled by {self.policy}: "
+                  f"{[req['Sample'] for req in ordered]}")
+        return ordered
@@ -1,46 +1,260 @@
-from typing import Union, Dict, Any
+from typing import (Union, Dict, Any, List, AsyncIterator, Iterator,
+                    Callable)
 from pathlib import Path
 import asyncio
+import queue
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 from .configuration import LoadConfig
 from .request import ServiceXRequest
-from .get_servicex_data import DataBinderDataset
-from .output_handler import OutputHandler
+from .get_servicex_data import DataBinderDataset, DeliveryEvent
+from .output_handler import CleanupHandle
+from .metrics import DeliveryMetrics
 
 import logging
 log = logging.getLogger(__name__)
 
 
+def _run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code. If an event loop
+    is already running in this thread (e.g. Jupyter), the coroutine runs
+    on its own loop in a worker thread instead of patching the running one.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
 class DataBinder:
     """
     Manage and categorize numerous ServiceX data from a configuration file
     """
 
-    def __init__(self, config: Union[str, Path, Dict[str, Any]]):
-        self._config = LoadConfig(config)
-        self._requests = ServiceXRequest(self._config).get_requests()
-        self._sx_db = DataBinderDataset(self._config, self._requests)
-
-        log.info(f"  {len(self._config.get('Sample'))} Samples"
-                 f" and {len(self._requests)} ServiceX requests")
+    def __init__(self, config: Union[str, Path, Dict[str, Any]],
+                 did_resolver: Callable[[str], List[str]] = None):
+        """
+        did_resolver resolves a Rucio DID to its files for Samples with
+        MaxFilesPerRequest (default: rucio client)
+        """
+        self._metrics = DeliveryMetrics()
+        with self._metrics.phase('load_config'):
+            self._config = LoadConfig(config)
+        builder = ServiceXRequest(self._config, did_resolver)
+        if self._config['General'].get('PipelineRequests'):
+            # requests are built by deliver() while the first ones run
+            self._requests = builder.iter_requests
+            log.info(f"  {len(self._config.get('Sample'))} Samples - "
+                     "ServiceX requests are built during delivery")
+        else:
+            with self._metrics.phase('build_requests'):
+                self._requests = builder.get_requests()
+            log.info(f"  {len(self._config.get('Sample'))} Samples"
+                     f" and {len(self._requests)} ServiceX requests")
+        self._sx_db = DataBinderDataset(self._config, self._requests,
+                                        self._metrics)
+        self._cleanup = None
 
     def deliver(self, overall_progress_only: bool = False) -> Dict:
+        """
+        Deliver all Samples and return the output paths dictionary.
+        Use adeliver() inside a running event loop.
+        """
+        return _run_sync(self.adeliver(overall_progress_only))
+
+    async def adeliver(self, overall_progress_only: bool = False) -> Dict:
+        """
+        Deliver all Samples on the running event loop
+        """
+        out_paths_dict = await self._sx_db.get_data(overall_progress_only)
+        await self._finish_delivery(out_paths_dict)
+        return out_paths_dict
 
-        out_paths_dict = asyncio.run(
-                self._sx_db.get_data(overall_progress_only)
+    async def adeliver_stream(self, overall_progress_only: bool = False
+                              ) -> AsyncIterator[DeliveryEvent]:
+        """
+        Deliver and yield (sample, tree, path) of each file as soon as it
+        lands, so that processing overlaps with the transformation.
+        Converted or merged files are yielded once their request is done.
+        """
+        async for event in self._sx_db.stream_data(overall_progress_only):
+            yield event
+        await self._finish_delivery(
+            self._sx_db.output_handler.out_paths_dict
             )
 
-        x = Thread(target=OutputHandler(self._config)
-                   .clean_up_files_not_in_requests, args=(out_paths_dict,))
-        x.start()
+    def deliver_iter(self, overall_progress_only: bool = False
+                     ) -> Iterator[DeliveryEvent]:
+        """
+        Blocking iterator over adeliver_stream() - the delivery runs
+        on its own event loop in a background thread
+        """
+        events = queue.Queue()
+        end = object()
+
+        async def consume():
+            async for event in self.adeliver_stream(overall_progress_only):
+                events.put(event)
+
+        def run():
+            try:
+                asyncio.run(consume())
+            except Exception as e:
+                events.put(e)
+            finally:
+                events.put(end)
+
+        Thread(target=run, daemon=True).start()
+        while True:
+            event = events.get()
+            if event is end:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    async def _finish_delivery(self, out_paths_dict: Dict):
+        # deliver() returns once files not in the requests are removed
+        with self._metrics.phase('clean_up'):
+            await self.clean_up(out_paths_dict)
 
         if len(self._sx_db.failed_request):
             log.warning(f"{len(self._sx_db.failed_request)} "
                         "failed delivery request(s)")
             log.warning("get_failed_requests() for detail of failed requests")
 
+    def retry_failed(self, overall_progress_only: bool = False) -> Dict:
+        """
+        Re-submit only the failed requests of the last delivery and
+        merge the delivered files into the output paths dictionary
+        """
+        return _run_sync(self.aretry_failed(overall_progress_only))
+
+    async def aretry_failed(self, overall_progress_only: bool = False
+                            ) -> Dict:
+        """
+        retry_failed() on the running event loop
+        """
+        if not self._sx_db.failed_request:
+            log.info("No failed delivery request to retry")
+            return self._sx_db.output_handler.out_paths_dict
+
+        # the clean-up must not see files of the retried requests
+        if self._cleanup is not None:
+            await self._cleanup
+
+        log.info(f"Retry {len(self._sx_db.failed_request)} "
+                 "failed delivery request(s)")
+        out_paths_dict = await self._sx_db.retry_failed(
+            overall_progress_only
+            )
+
+        if len(self._sx_db.failed_request):
+            log.warning(f"{len(self._sx_db.failed_request)} "
+                        "failed delivery request(s)")
         return out_paths_dict
 
+    def clean_up(self, out_paths_dict: Dict = None,
+                 dry_run: bool = False) -> CleanupHandle:
+        """
+        Remove Samples and files in the OutputDirectory which are not in
+        the output paths dictionary (default: of the last delivery) in
+        the background. join() or await the returned handle for the
+        report of removed Samples and files; with dry_run nothing is
+        removed and the report lists what would be.
+        """
+        if out_paths_dict is None:
+            out_paths_dict = self._sx_db.output_handler.out_paths_dict
+        self._cleanup = self._sx_db.output_handler.start_clean_up(
+            out_paths_dict, dry_run
+            )
+        return self._cleanup
+
+    def verify(self, checksum: bool = False) -> Dict[str, List[str]]:
+        """
+        Walk the OutputDirectory and reconcile it with the delivery manifest.
+        Missing or modified files are delivered again by the next deliver().
+        With checksum, files are re-hashed in parallel against the checksums
+        recorded with the Checksum option and corrupted ones are delivered
+        again as well.
+        """
+        report = self._sx_db.output_handler.manifest.verify(
+            checksum, self._config['General']['CopyWorkers']
+            )
+        self._sx_db.output_handler.manifest.save()
+        for key, files in report.items():
+            if files:
+                log.warning(f"{len(files)} {key} file(s) in the "
+                            "OutputDirectory")
+        return report
+
+    def invalidate_cache(self, sample: str = None):
+        """
+        Invalidate the result cache of a Sample (all Samples if None),
+        so that the next deliver() makes ServiceX requests again
+        """
+        self._sx_db.output_handler.manifest.invalidate(sample)
+        self._sx_db.output_handler.manifest.save()
+
+    def sample_to_root(self, sample: str):
+        """
+        Convert delivered parquet files of a Sample to ROOT ntuples
+        """
+        return self._sx_db.output_handler.sample_to_root(sample)
+
+    def get_merged_sources(self) -> Dict[str, List[str]]:
+        """
+        Merged file path -> ServiceX files it was merged from
+        """
+        return self._sx_db.output_handler.merged_sources()
+
+    def get_file_metadata(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Delivered file path -> size, num_rows, entry_offsets and schema
+        (with FileMetadata)
+        """
+        return dict(self._sx_db.output_handler.catalog.metadata)
+
+    def get_chunk_plan(self, chunk_size: int = None) -> Dict[str, Any]:
+        """
+        Chunk plan of the delivered files (see ChunkSize) as a
+        preprocessed coffea fileset
+        """
+        chunk_size = chunk_size or self._config['General'].get('ChunkSize')
+        if not chunk_size:
+            raise ValueError("Set ChunkSize in the config or chunk_size")
+        return self._sx_db.output_handler.chunk_plan(chunk_size)
+
     def get_failed_requests(self):
         return self._sx_db.failed_request
+
+    def get_request_counters(self) -> Dict[str, int]:
+        """
+        Number of queued, in-flight and completed ServiceX requests
+        """
+        return dict(self._sx_db.request_counters)
+
+    def get_metrics(self, format: str = "dict") -> Union[Dict, str]:
+        """
+        Timing and throughput of the phases and of each request of the
+        last delivery - as a dict, "json" or "prometheus" text format
+        """
+        if format == "json":
+            return self._metrics.to_json(indent=2)
+        if format == "prometheus":
+            return self._metrics.to_prometheus()
+        if format != "dict":
+            raise ValueError(f"Unknown metrics format {format!r} - "
+                             "dict, json or prometheus")
+        return self._metrics.as_dict()
+
+    def export_spans(self, tracer=None) -> int:
+        """
+        Emit phases and requests of the last delivery as OpenTelemetry
+        spans (requires the opentelemetry API)
+        """
+        return self._metrics.export_spans(tracer)
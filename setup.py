@@ -37,7 +37,6 @@ setuptools.setup(name="servicex_databinder",
                  install_requires=[
                     "servicex>=2.6.2",
                     "tcut-to-qastle>=0.7",
-                    "nest-asyncio>=1.5.1",
                     "tqdm>=4.60.0",
                     "pyarrow>=3.0.0",
                     "backoff>=1.11.1",
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from servicex_databinder.configuration import LoadConfig
+from servicex_databinder.request import ServiceXRequest
+
+pytest.importorskip("tcut_to_qastle")
+
+N_SAMPLES = 10000
+N_DEFINITIONS = 200
+N_QUERIES = 100
+
+
+def synthetic_config():
+    definitions = {f"DEF_col{i}": f"jet_pt{i}, jet_eta{i}"
+                   for i in range(N_DEFINITIONS)}
+    definitions["DEF_sel"] = "jet_pt0 > 25e3"
+    samples = [{
+        "Name": f"sample{i}",
+        "RucioDID": f"user.kchoi:user.kchoi.sample{i}",
+        "Tree": "nominal",
+        "Columns": f"DEF_col{i % N_QUERIES}, DEF_col{N_DEFINITIONS - 1}",
+        "Filter": "DEF_sel",
+    } for i in range(N_SAMPLES)]
+    return {
+        "General": {
+            "ServiceXName": "uproot",
+            "Transformer": "uproot",
+            "OutputFormat": "parquet",
+            "QueryCache": False,
+        },
+        "Definition": definitions,
+        "Sample": samples,
+    }
+
+
+def test_benchmark_10k_samples():
+    config = synthetic_config()
+
+    start = time.perf_counter()
+    config = LoadConfig(config)
+    load_time = time.perf_counter() - start
+    assert config["Sample"][1]["Columns"] == "jet_pt1, jet_eta1, " \
+        f"jet_pt{N_DEFINITIONS - 1}, jet_eta{N_DEFINITIONS - 1}"
+
+    start = time.perf_counter()
+    requests = ServiceXRequest(config).get_requests()
+    build_time = time.perf_counter() - start
+    assert len(requests) == N_SAMPLES
+    assert len({req["query"] for req in requests}) == N_QUERIES
+
+    print(f"{N_SAMPLES} samples: LoadConfig {load_time * 1e3:.0f} ms, "
+          f"requests {build_time * 1e3:.0f} ms")
@@ -0,0 +1,26 @@
+from servicex_databinder.catalog import OutputCatalog, load_output_dict
+
+config = {"Sample": [{"Name": "ttH", "Tree": "nominal, sys"},
+                     {"Name": "data"}]}
+
+
+def test_add_keeps_order_without_duplicates():
+    catalog = OutputCatalog(config)
+    catalog.add("ttH", "nominal", ["b", "a"])
+    catalog.add("ttH", "nominal", ["a", "c"])
+    catalog.add("data", None, ["d"])
+    assert catalog.paths("ttH", "nominal") == ["b", "a", "c"]
+    assert catalog.as_dict() == {"ttH": {"nominal": ["b", "a", "c"],
+                                         "sys": []},
+                                 "data": ["d"]}
+    catalog.replace("ttH", "nominal", ["e"])
+    assert catalog.paths("ttH", "nominal") == ["e"]
+
+
+def test_write_and_load(tmp_path):
+    catalog = OutputCatalog(config)
+    catalog.add("ttH", "sys", ["/data/b.parquet", "/data/a.parquet"])
+    for fmt in ["yaml", "json"]:
+        path = catalog.write(tmp_path / "fileset", fmt)
+        assert path.suffix in [".yml", ".json"]
+        assert load_output_dict(path) == catalog.as_dict()
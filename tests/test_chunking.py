@@ -0,0 +1,34 @@
+from servicex_databinder.chunking import chunk_plan, plan_steps
+
+
+def test_balanced_steps():
+    assert plan_steps(10, 4) == [[0, 3], [3, 7], [7, 10]]
+    assert plan_steps(8, 10) == [[0, 8]]
+    assert plan_steps(0, 10) == []
+
+
+def test_steps_aligned_to_row_groups():
+    offsets = [0, 3, 6, 9, 12]
+    assert plan_steps(12, 6, offsets) == [[0, 6], [6, 12]]
+    assert plan_steps(100, 50, [0, 45, 100]) == [[0, 45], [45, 100]]
+    # boundaries far from a row group stay balanced
+    assert plan_steps(12, 2, [0, 6, 12]) == \
+        [[0, 2], [2, 4], [4, 6], [6, 8], [8, 10], [10, 12]]
+    assert plan_steps(600, 100, [0, 100, 300, 600]) == \
+        [[i, i + 100] for i in range(0, 600, 100)]
+
+
+def test_chunk_plan():
+    files = [("ttH", "nominal", ["/a.parquet", "/b.parquet"]),
+             ("data", None, ["/c.root"])]
+    metadata = {"/a.parquet": {"num_rows": 4, "entry_offsets": [0, 4]},
+                "/c.root": {"num_rows": 2, "tree": "CollectionTree"}}
+    plan = chunk_plan(files, metadata, 2)
+    assert plan == {
+        "ttH/nominal": {"files": {"/a.parquet": {
+            "object_path": "nominal", "num_entries": 4,
+            "steps": [[0, 2], [2, 4]]}}},
+        "data": {"files": {"/c.root": {
+            "object_path": "CollectionTree", "num_entries": 2,
+            "steps": [[0, 2]]}}},
+        }
@@ -0,0 +1,44 @@
+import pytest
+
+from servicex_databinder import compaction
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+uproot = pytest.importorskip("uproot")
+
+
+def test_parse_size():
+    assert compaction.parse_size("1GB") == 10**9
+    assert compaction.parse_size("500 mb") == 500 * 10**6
+    assert compaction.parse_size(2) == 2 * 10**6
+    with pytest.raises(ValueError):
+        compaction.parse_size("big")
+
+
+def test_plan_merges():
+    files = [("a", 4), ("b", 4), ("c", 4), ("d", 20), ("e", 1)]
+    assert compaction.plan_merges(files, 10) \
+        == [["a", "b"], ["c"], ["d"], ["e"]]
+
+
+def test_merge_parquet(tmp_path):
+    sources = []
+    for i in range(3):
+        sources.append(tmp_path / f"{i}.parquet")
+        pq.write_table(pa.table({"x": [i] * 10}), sources[-1])
+    assert compaction.merge_parquet(sources, tmp_path / "m.parquet") == 30
+    assert pq.read_table(tmp_path / "m.parquet").column("x").to_pylist() \
+        == [0] * 10 + [1] * 10 + [2] * 10
+
+
+def test_merge_root(tmp_path):
+    sources = []
+    for i in range(2):
+        sources.append(tmp_path / f"{i}.root")
+        with uproot.recreate(sources[-1]) as f:
+            f.mktree("nominal", {"x": "int64"}).extend({"x": [i] * 5})
+    job = {"sources": sources, "target": tmp_path / "m.root",
+           "tree": "nominal"}
+    assert compaction.merge_files(job) == 10
+    assert uproot.open(tmp_path / "m.root")["nominal"]["x"].array()\
+        .tolist() == [0] * 5 + [1] * 5
@@ -146,6 +146,55 @@ def test_validate_config():
     assert configuration._validate_config(config_valid_uproot)
 
 
+def test_validate_max_concurrent_requests():
+    config = {
+        "General": {
+            "ServiceXName": "uproot",
+            "OutputFormat": "parquet",
+            "MaxConcurrentRequests": 0,
+        },
+        "Sample": [{
+            "Name": "ttH",
+            "RucioDID": "user.kchoi:user.kchoi.A",
+            "Tree": "nominal",
+            "Columns": "jet_pt",
+        }]
+    }
+    with pytest.raises(ValueError):
+        configuration._validate_config(config)
+
+    config["General"]["MaxConcurrentRequests"] = 10
+    assert configuration._validate_config(config)
+
+
+def test_validate_conversion():
+    config = {
+        "General": {
+            "ServiceXName": "uproot",
+            "OutputFormat": "parquet",
+            "ConvertTo": "ROOT",
+            "ConvertCompression": "zstd:5",
+        },
+        "Sample": [{
+            "Name": "ttH",
+            "RucioDID": "user.kchoi:user.kchoi.A",
+            "Tree": "nominal",
+            "Columns": "jet_pt",
+        }]
+    }
+    assert configuration._validate_config(config)
+    assert config["General"]["ConvertTo"] == "root"
+
+    config["General"]["ConvertCompression"] = "snappy"
+    with pytest.raises(ValueError):
+        configuration._validate_config(config)
+
+    config["General"]["ConvertCompression"] = "zstd"
+    config["General"]["ConvertTo"] = "parquet"
+    with pytest.raises(ValueError):
+        configuration._validate_config(config)
+
+
 
 
 # def test_validate_config_for_uproot():
@@ -176,4 +225,4 @@ def test_validate_config():
 #             "FuncADL": 1,
 #         }]
 #     }
-#     assert configuration._validate_config(config_valid_xaod)
\ No newline at end of file
+#     assert configuration._validate_config(config_valid_xaod)
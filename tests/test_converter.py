@@ -0,0 +1,84 @@
+import subprocess
+import sys
+
+import pytest
+
+from servicex_databinder import converter
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+uproot = pytest.importorskip("uproot")
+
+
+def write_parquet(path, n):
+    table = pa.table({"x": list(range(n)),
+                      "jet_pt": [[float(i)] * (i % 3) for i in range(n)]})
+    pq.write_table(table, path, row_group_size=10)
+
+
+def test_parquet_to_root_streaming(tmp_path):
+    write_parquet(tmp_path / "a.parquet", 100)
+    # a tiny memory cap forces many batches
+    assert converter.parquet_to_root("nominal", tmp_path / "a.parquet",
+                                     tmp_path / "a.root", max_memory=1e-4)
+    tree = uproot.open(tmp_path / "a.root")["nominal"]
+    assert tree.num_entries == 100
+    assert tree["x"].array().tolist() == list(range(100))
+    assert tree["jet_pt"].array().tolist()[4] == [4.0]
+
+
+def test_parquet_to_root_empty(tmp_path):
+    write_parquet(tmp_path / "a.parquet", 0)
+    assert not converter.parquet_to_root("nominal", tmp_path / "a.parquet",
+                                         tmp_path / "a.root")
+    assert not (tmp_path / "a.root").exists()
+
+
+def test_bulk_parquet_to_root(tmp_path):
+    jobs = []
+    for i in range(3):
+        write_parquet(tmp_path / f"{i}.parquet", 20)
+        jobs.append(("nominal", tmp_path / f"{i}.parquet",
+                     tmp_path / f"{i}.root"))
+    assert converter.bulk_parquet_to_root(jobs, workers=2) == [True] * 3
+    for _, _, root_file in jobs:
+        assert uproot.open(root_file)["nominal"].num_entries == 20
+
+
+def test_root_to_parquet(tmp_path):
+    write_parquet(tmp_path / "a.parquet", 50)
+    converter.parquet_to_root("nominal", tmp_path / "a.parquet",
+                              tmp_path / "a.root", compression="zstd")
+    job = {"source": tmp_path / "a.root", "target": tmp_path / "b.parquet",
+           "to": "parquet", "tree": None, "compression": "zstd:3",
+           "row_group_size": 20}
+    assert converter.convert_file(job)
+    pf = pq.ParquetFile(tmp_path / "b.parquet")
+    assert pf.metadata.num_rows == 50
+    assert pf.metadata.num_row_groups == 3
+    assert pf.metadata.row_group(0).column(0).compression == "ZSTD"
+    assert pf.schema_arrow.names == ["x", "jet_pt"]
+    assert pf.read().column("x").to_pylist() == list(range(50))
+
+
+def test_parquet_to_root_memory_of_one_row_group(tmp_path):
+    # a single row group larger than the memory cap is read page by page
+    np = pytest.importorskip("numpy")
+    n = 1000000
+    rng = np.random.default_rng(0)
+    pq.write_table(pa.table({f"x{i}": rng.random(n) for i in range(4)}),
+                   tmp_path / "a.parquet", row_group_size=n,
+                   compression="none")
+    # peak arrow memory of a fresh process
+    code = ("import sys, pyarrow as pa\n"
+            "from servicex_databinder import converter\n"
+            "converter.parquet_to_root('nominal', sys.argv[1], sys.argv[2],"
+            " max_memory=2)\n"
+            "print(pa.default_memory_pool().max_memory())\n")
+    result = subprocess.run(
+        [sys.executable, "-c", code, str(tmp_path / "a.parquet"),
+         str(tmp_path / "a.root")],
+        capture_output=True, text=True, check=True)
+    # less than the decoded row group of 32 MB
+    assert int(result.stdout.split()[-1]) < 32e6
+    assert uproot.open(tmp_path / "a.root")["nominal"].num_entries == n
@@ -0,0 +1,37 @@
+from servicex_databinder.copy_engine import CopyEngine, copy_file
+
+
+def test_copy_file(tmp_path):
+    src = tmp_path / "a.parquet"
+    src.write_bytes(b"x" * 100000)
+    dst = tmp_path / "b.parquet"
+    assert copy_file(src, dst) == 100000
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_copy_engine(tmp_path):
+    pairs = []
+    for i in range(5):
+        src = tmp_path / f"in_{i}.root"
+        src.write_bytes(bytes([i]) * 1000)
+        pairs.append((src, tmp_path / f"out_{i}.root"))
+
+    engine = CopyEngine(workers=2)
+    assert engine.copy_files(pairs) == 5000
+    assert engine.files_copied == 5
+    for src, dst in pairs:
+        assert dst.read_bytes() == src.read_bytes()
+    engine.shutdown()
+
+
+def test_link_files(tmp_path):
+    src = tmp_path / "a.parquet"
+    src.write_bytes(b"data")
+    dst = tmp_path / "b.parquet"
+
+    engine = CopyEngine(workers=1)
+    assert engine.link_files([(src, dst)]) == 0
+    assert engine.files_linked == 1
+    assert dst.read_bytes() == b"data"
+    assert dst.stat().st_ino == src.stat().st_ino
+    engine.shutdown()
@@ -0,0 +1,29 @@
+import pytest
+
+from servicex_databinder.dispatcher import BackendDispatcher, primary_backend
+
+
+def _config(policy, backends):
+    return {"General": {"ServiceXName": backends, "LoadBalancing": policy}}
+
+
+def test_round_robin():
+    dispatcher = BackendDispatcher(
+        _config("round-robin", ["a", {"Name": "b", "Weight": 3}])
+        )
+    picks = [dispatcher.choose() for _ in range(8)]
+    assert picks.count("a") == 2 and picks.count("b") == 6
+
+
+def test_least_outstanding_and_failover():
+    config = _config("least-outstanding", ["a", "b"])
+    assert primary_backend(config) == "a"
+    dispatcher = BackendDispatcher(config)
+    dispatcher.start(dispatcher.choose())
+    assert dispatcher.choose() == "b"
+    assert dispatcher.choose(exclude=["b"]) == "a"
+    with pytest.raises(ValueError):
+        dispatcher.choose(exclude=["a", "b"])
+    dispatcher.finish("a", nbytes=10)
+    assert dispatcher.stats["a"] == {"completed": 1, "failed": 0,
+                                     "bytes": 10}
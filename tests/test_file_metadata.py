@@ -0,0 +1,34 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import uproot
+
+from servicex_databinder.file_metadata import read_metadata
+
+
+def test_parquet_metadata(tmp_path):
+    path = tmp_path / "a.parquet"
+    pq.write_table(pa.table({"x": list(range(10)), "y": [1.] * 10}), path,
+                   row_group_size=4)
+    metadata = read_metadata(path)
+    assert metadata['num_rows'] == 10
+    assert metadata['entry_offsets'] == [0, 4, 8, 10]
+    assert metadata['schema'] == {"x": "int64", "y": "double"}
+    assert metadata['size'] == path.stat().st_size
+
+
+def test_root_metadata(tmp_path):
+    path = tmp_path / "a.root"
+    with uproot.recreate(path) as f:
+        f.mktree("nominal", {"x": "int64"}).extend({"x": list(range(10))})
+    metadata = read_metadata(path)
+    assert metadata['tree'] == "nominal"
+    assert metadata['num_rows'] == 10
+    assert metadata['entry_offsets'][0] == 0
+    assert metadata['entry_offsets'][-1] == 10
+    assert list(metadata['schema']) == ["x"]
+
+
+def test_unreadable_file(tmp_path):
+    path = tmp_path / "a.parquet"
+    path.write_bytes(b"truncated")
+    assert read_metadata(path) == {'size': 9}
@@ -0,0 +1,66 @@
+import asyncio
+
+from servicex.utils import ServiceXException
+
+from servicex_databinder.get_servicex_data import DataBinderDataset
+from servicex_databinder.request import ServiceXRequest
+
+
+def test_failed_request_with_fanout(tmp_path):
+    sample = {"Name": "ttH", "Tree": "nominal", "Columns": "jet_pt",
+              "XRootDFiles": "root://eos/a.root", "Type": "uproot",
+              "Transformer": "uproot"}
+    config = {"General": {"ServiceXName": "uproot", "OutputFormat": "parquet",
+                          "Delivery": "LocalPath", "MaxConcurrentRequests": 2,
+                          "CopyWorkers": 2, "QueryCache": False,
+                          "OutputDirectory": str(tmp_path)},
+              "Sample": [sample, dict(sample, Name="ttH_copy")]}
+    requests = ServiceXRequest(config).get_requests()
+    assert [req["Sample"] for req in requests[0]["fanout"]] == ["ttH_copy"]
+
+    sx_db = DataBinderDataset(config, requests)
+
+    async def fetch_files(*args):
+        raise ServiceXException("Failed to transform all files")
+    sx_db._fetch_files = fetch_files
+    sx_db.metrics.request("h", requests[0])
+    message = asyncio.run(sx_db._deliver_and_copy(
+        requests[0], 1, "ttH - nominal", None, "h"))
+
+    assert "ttH, ttH_copy | nominal" in message
+    assert [(failed["request"]["Sample"], failed.get("fanout_of"))
+            for failed in sx_db.failed_request] \
+        == [("ttH", None), ("ttH_copy", "ttH")]
+
+
+def test_late_duplicate_of_failed_request(tmp_path):
+    req = {"Sample": "A", "tree": "nominal", "dataset": "user.kchoi:A",
+           "type": "uproot", "codegen": "uproot", "query": "(Select ...)"}
+    dup = dict(req, Sample="B")
+    config = {"General": {"ServiceXName": "uproot", "OutputFormat": "parquet",
+                          "Delivery": "LocalPath", "MaxConcurrentRequests": 2,
+                          "CopyWorkers": 2, "QueryCache": False,
+                          "OutputDirectory": str(tmp_path)},
+              "Sample": [{"Name": "A", "Tree": "nominal"},
+                         {"Name": "B", "Tree": "nominal"}]}
+    sx_db = DataBinderDataset(config, [])
+
+    async def fetch_files(*args):
+        raise ServiceXException("ServiceX rejected the transformation "
+                                "request: (400) bad query")
+    sx_db._fetch_files = fetch_files
+
+    async def deliver():
+        # B is built after the request of A has failed
+        incoming = sx_db._incoming_requests(iter([req, dup]))
+        submitted = []
+        async for r in incoming:
+            submitted.append(r["Sample"])
+            sx_db.metrics.request(r["Sample"], r)
+            await sx_db._deliver_and_copy(r, 1, r["Sample"], None,
+                                          r["Sample"])
+        return submitted
+
+    assert asyncio.run(deliver()) == ["A", "B"]
+    assert [failed["request"]["Sample"]
+            for failed in sx_db.failed_request] == ["A", "B"]
@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ['uproot', 'awkward', 'pyarrow', 'func_adl_servicex', 'qastle',
+                 'tcut_to_qastle', 'aiohttp', 'tqdm', 'servicex',
+                 'nest_asyncio']
+
+IMPORT_BENCHMARK = """
+import sys, time
+start = time.perf_counter()
+from servicex_databinder import DataBinder
+print(time.perf_counter() - start)
+print(','.join(sorted({m.split('.')[0] for m in sys.modules})))
+"""
+
+
+def test_import_is_lazy():
+    # fresh interpreter so that nothing is imported yet
+    out = subprocess.run([sys.executable, "-c", IMPORT_BENCHMARK],
+                         capture_output=True, text=True, check=True)
+    elapsed, modules = out.stdout.splitlines()
+    print(f"import servicex_databinder: {float(elapsed) * 1e3:.0f} ms")
+    loaded = set(modules.split(','))
+    assert not loaded.intersection(HEAVY_MODULES)
@@ -0,0 +1,30 @@
+import pytest
+
+from servicex_databinder import integrity
+from servicex_databinder.integrity import file_checksum, matches_checksum
+
+
+def test_adler32(tmp_path, monkeypatch):
+    path = tmp_path / "a.parquet"
+    path.write_bytes(b"abc")
+    assert file_checksum(path) == "adler32:024d0127"
+    # checksums of files larger than one block
+    monkeypatch.setattr(integrity, "BLOCK_SIZE", 2)
+    assert file_checksum(path) == "adler32:024d0127"
+
+
+def test_matches_checksum(tmp_path):
+    path = tmp_path / "a.parquet"
+    path.write_bytes(b"abc")
+    checksum = file_checksum(path)
+    assert matches_checksum(path, checksum)
+    path.write_bytes(b"abd")
+    assert not matches_checksum(path, checksum)
+    assert not matches_checksum(tmp_path / "missing.parquet", checksum)
+
+
+def test_unknown_algorithm(tmp_path):
+    path = tmp_path / "a.parquet"
+    path.write_bytes(b"abc")
+    with pytest.raises(ValueError):
+        file_checksum(path, "md5")
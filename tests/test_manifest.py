@@ -0,0 +1,94 @@
+import os
+
+from servicex_databinder.manifest import DeliveryManifest, request_hash
+
+config = {"General": {"OutputFormat": "parquet"}}
+req = {"Sample": "ttH", "tree": "nominal", "dataset": "user.kchoi:A",
+       "codegen": "uproot", "query": "(Select ...)"}
+
+
+def test_request_hash():
+    assert request_hash(req, config) == request_hash(dict(req), config)
+    assert request_hash(req, config) \
+        != request_hash(dict(req, tree="sys"), config)
+
+
+def test_record_and_reload(tmp_path):
+    target = tmp_path / "ttH" / "nominal"
+    target.mkdir(parents=True)
+    (target / "a.parquet").write_bytes(b"a")
+    (target / "b.parquet").write_bytes(b"bb")
+
+    manifest = DeliveryManifest(tmp_path)
+    assert manifest.is_new
+    manifest.record("h", req, target, ["a.parquet", "b.parquet"])
+    manifest.save()
+
+    manifest = DeliveryManifest(tmp_path)
+    assert not manifest.is_new
+    assert manifest.delivered_files("h") == {
+        "a.parquet": "ttH/nominal/a.parquet",
+        "b.parquet": "ttH/nominal/b.parquet"}
+    assert manifest.files["ttH/nominal/b.parquet"]["size"] == 2
+
+    manifest.forget_files(["ttH/nominal/a.parquet"])
+    assert list(manifest.delivered_files("h")) == ["b.parquet"]
+
+
+def test_verify(tmp_path):
+    target = tmp_path / "ttH" / "nominal"
+    target.mkdir(parents=True)
+    for name in ["a.parquet", "b.parquet"]:
+        (target / name).write_bytes(b"data")
+
+    manifest = DeliveryManifest(tmp_path)
+    manifest.record("h", req, target, ["a.parquet", "b.parquet"])
+    (target / "a.parquet").unlink()
+    (target / "c.parquet").write_bytes(b"c")
+
+    report = manifest.verify()
+    assert report["missing"] == ["ttH/nominal/a.parquet"]
+    assert report["untracked"] == ["ttH/nominal/c.parquet"]
+    assert list(manifest.delivered_files("h")) == ["b.parquet"]
+
+
+def test_verify_checksum(tmp_path):
+    from servicex_databinder.integrity import file_checksum
+    target = tmp_path / "ttH" / "nominal"
+    target.mkdir(parents=True)
+    for name in ["a.parquet", "b.parquet"]:
+        (target / name).write_bytes(b"data")
+
+    manifest = DeliveryManifest(tmp_path)
+    manifest.record("h", req, target, ["a.parquet", "b.parquet"], "key")
+    manifest.set_checksums({rel: file_checksum(tmp_path / rel)
+                            for rel in manifest.tracked_files()})
+    # same size and modification time, different content
+    st = (target / "a.parquet").stat()
+    (target / "a.parquet").write_bytes(b"dat4")
+    os.utime(target / "a.parquet", ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    assert manifest.verify()["corrupted"] == []
+    report = manifest.verify(checksum=True, workers=2)
+    assert report["corrupted"] == ["ttH/nominal/a.parquet"]
+    assert list(manifest.delivered_files("h")) == ["b.parquet"]
+    # the request is delivered again instead of served by the result cache
+    assert manifest.cached_files("h", "key") is None
+
+
+def test_cached_files(tmp_path):
+    target = tmp_path / "ttH" / "nominal"
+    target.mkdir(parents=True)
+    (target / "a.parquet").write_bytes(b"data")
+
+    manifest = DeliveryManifest(tmp_path)
+    manifest.record("h", req, target, ["a.parquet"], "key")
+    assert manifest.cached_files("h", "key") == [target / "a.parquet"]
+    assert manifest.cached_files("h", "other") is None
+    assert manifest.cached_files("h", "key", ttl=1e-9) is None
+
+    (target / "a.parquet").write_bytes(b"truncated")
+    assert manifest.cached_files("h", "key") is None
+
+    manifest.invalidate("ttH")
+    assert manifest.cached_files("h", "key") is None
@@ -0,0 +1,81 @@
+import json
+
+from servicex_databinder.metrics import DeliveryMetrics
+
+
+def _req(sample):
+    return {'Sample': sample, 'tree': 'nominal', 'codegen': 'uproot'}
+
+
+def test_request_stages():
+    metrics = DeliveryMetrics()
+    with metrics.phase('deliver'):
+        metrics.request('a', _req('A'))
+        for event in ['submitted', 'transformed', 'downloaded', 'copied']:
+            metrics.mark('a', event)
+        metrics.mark('a', 'completed', status='delivered', files=2,
+                     bytes=100)
+    m = metrics.as_dict()
+    assert list(m['requests']['a']['stages']) == \
+        ['queue', 'transform', 'download', 'copy', 'post_process']
+    assert m['requests']['a']['status'] == 'delivered'
+    assert m['throughput']['bytes_per_second'] > 0
+    assert json.loads(metrics.to_json())['requests']['a']['files'] == 2
+
+
+def test_status_callback_marks_transform_and_download():
+    metrics = DeliveryMetrics()
+    metrics.request('a', _req('A'))
+    updates = []
+    factory = metrics.status_factory(
+        'a', lambda ds, title, downloading: lambda *args: updates.append(args)
+        )
+    callback = factory('ds', 'A', True)
+    callback(2, 1, 0, 0)
+    assert 'transformed' not in metrics.requests['a']
+    callback(2, 2, 2, 0)
+    assert 'transformed' in metrics.requests['a']
+    assert 'downloaded' in metrics.requests['a']
+    assert len(updates) == 2
+
+
+def test_prometheus_format():
+    metrics = DeliveryMetrics()
+    with metrics.phase('load_config'):
+        pass
+    metrics.request('a', _req('A "quoted"'))
+    metrics.mark('a', 'submitted')
+    metrics.mark('a', 'completed', status='failed')
+    metrics.count('fanned_out_requests')
+    text = metrics.to_prometheus()
+    assert 'servicex_databinder_phase_seconds{phase="load_config"}' in text
+    assert 'sample="A \\"quoted\\""' in text
+    assert 'servicex_databinder_requests_total{status="failed"} 1' in text
+    assert 'servicex_databinder_fanned_out_requests_total 1' in text
+    for line in text.splitlines():
+        assert line.startswith('#') or len(line.rsplit(' ', 1)) == 2
+
+
+def test_prometheus_series_per_request():
+    metrics = DeliveryMetrics()
+    for key in ['a', 'b']:
+        metrics.request(key, _req('A'))
+        metrics.mark(key, 'submitted')
+        metrics.mark(key, 'transformed')
+    series = [line.rsplit(' ', 1)[0]
+              for line in metrics.to_prometheus().splitlines()
+              if line.startswith('servicex_databinder_request_stage')]
+    assert len(series) == len(set(series)) == 4
+    assert 'request="b"' in series[-1]
+
+
+def test_prometheus_values():
+    metrics = DeliveryMetrics()
+    metrics.request('a', _req('A'))
+    metrics.mark('a', 'completed', status='delivered', bytes=1234567890)
+    metrics.request('b', _req('B'))
+    metrics.record('bytes_copied', 9876543210)
+    text = metrics.to_prometheus()
+    assert 'servicex_databinder_bytes_total 1234567890\n' in text
+    assert 'servicex_databinder_bytes_copied_total 9876543210\n' in text
+    assert 'servicex_databinder_requests_total{status="unknown"} 1' in text
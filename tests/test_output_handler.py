@@ -0,0 +1,121 @@
+import asyncio
+
+from servicex_databinder.manifest import request_hash
+from servicex_databinder.output_handler import OutputHandler
+
+req = {"Sample": "ttH", "tree": "nominal", "dataset": "user.kchoi:A",
+       "codegen": "uproot", "query": "(Select ...)"}
+
+
+def _handler(tmp_path):
+    config = {"General": {"OutputFormat": "parquet", "CopyWorkers": 2,
+                          "ServiceXName": "uproot",
+                          "OutputDirectory": str(tmp_path)},
+              "Sample": [{"Name": "ttH", "Tree": "nominal"}]}
+    handler = OutputHandler(config)
+    target = tmp_path / "ttH" / "nominal"
+    target.mkdir(parents=True)
+    for name in ["a.parquet", "b.parquet"]:
+        (target / name).write_bytes(b"a")
+    handler.manifest.record("h", req, target, ["a.parquet", "b.parquet"])
+    (tmp_path / "old_sample").mkdir()
+    (tmp_path / "old_sample" / "c.parquet").write_bytes(b"c")
+    out_paths_dict = {"ttH": {"nominal": [str(target / "a.parquet")]}}
+    return handler, out_paths_dict
+
+
+def test_clean_up_dry_run(tmp_path):
+    handler, out_paths_dict = _handler(tmp_path)
+    report = handler.clean_up_files_not_in_requests(out_paths_dict,
+                                                    dry_run=True)
+    assert report == {"samples": ["old_sample"], "trees": [],
+                      "files": ["ttH/nominal/b.parquet"]}
+    assert (tmp_path / "ttH" / "nominal" / "b.parquet").exists()
+    assert (tmp_path / "old_sample").exists()
+
+
+def test_clean_up_handle(tmp_path):
+    handler, out_paths_dict = _handler(tmp_path)
+    report = handler.start_clean_up(out_paths_dict).join()
+    assert report["files"] == ["ttH/nominal/b.parquet"]
+    assert not (tmp_path / "ttH" / "nominal" / "b.parquet").exists()
+    assert (tmp_path / "ttH" / "nominal" / "a.parquet").exists()
+    assert not (tmp_path / "old_sample").exists()
+    assert handler.manifest.tracked_files() == ["ttH/nominal/a.parquet"]
+
+    async def clean_up_again():
+        return await handler.start_clean_up(out_paths_dict)
+    assert asyncio.run(clean_up_again()) \
+        == {"samples": [], "trees": [], "files": []}
+
+
+def test_clean_up_output_directory_without_manifest(tmp_path):
+    config = {"General": {"OutputFormat": "parquet", "CopyWorkers": 2,
+                          "ServiceXName": "uproot",
+                          "OutputDirectory": str(tmp_path)},
+              "Sample": [{"Name": "ttH", "Tree": "nominal"}]}
+    for tree, name in [("nominal", "a.parquet"), ("nominal", "old.parquet"),
+                       ("sys", "old.parquet")]:
+        (tmp_path / "ttH" / tree).mkdir(parents=True, exist_ok=True)
+        (tmp_path / "ttH" / tree / name).write_bytes(b"a")
+    handler = OutputHandler(config)
+    out_paths_dict = {"ttH": {"nominal": [
+        str(tmp_path / "ttH" / "nominal" / "a.parquet")]}}
+    report = handler.clean_up_files_not_in_requests(out_paths_dict)
+    assert report == {"samples": [], "trees": ["ttH/sys"],
+                      "files": ["ttH/nominal/old.parquet"]}
+    assert sorted(p.relative_to(tmp_path).as_posix()
+                  for p in tmp_path.rglob("*.parquet")) \
+        == ["ttH/nominal/a.parquet"]
+
+
+def test_incomplete_copy_is_copied_again(tmp_path):
+    handler, _ = _handler(tmp_path)
+    source = tmp_path / "sx"
+    source.mkdir()
+    for name in ["a.parquet", "b.parquet"]:
+        (source / name).write_bytes(b"a")
+    target = tmp_path / "ttH" / "nominal"
+    handler.manifest.record(request_hash(req, handler._config), req,
+                            target, ["a.parquet", "b.parquet"])
+    (target / "b.parquet").write_bytes(b"")
+
+    handler.copy_to_target(1, req, [source / "a.parquet",
+                                    source / "b.parquet"])
+    assert (target / "b.parquet").read_bytes() == b"a"
+    assert handler.manifest.matches(target / "b.parquet")
+    assert handler.copy_engine.files_copied == 1
+
+
+def test_incomplete_streamed_file_is_copied_again(tmp_path):
+    handler, _ = _handler(tmp_path)
+    source = tmp_path / "sx"
+    source.mkdir()
+    (source / "a.parquet").write_bytes(b"a")
+    target = tmp_path / "ttH" / "nominal"
+    handler.manifest.record(request_hash(req, handler._config), req,
+                            target, ["a.parquet"])
+    (target / "a.parquet").write_bytes(b"")
+
+    path = handler.copy_file_to_target(1, req, source / "a.parquet")
+    assert path.read_bytes() == b"a"
+    handler.copy_file_to_target(1, req, source / "a.parquet")
+    assert handler.copy_engine.files_copied == 1
+
+
+def test_output_dict_removed_without_write_output_dict(tmp_path):
+    handler, _ = _handler(tmp_path)
+    handler._config["General"].update({"WriteOutputDict": "fileset",
+                                       "OutputDictFormat": ["yaml", "json"],
+                                       "ChunkSize": 10})
+    handler.write_output_paths_dict()
+    handler.manifest.save()
+    assert (tmp_path / "fileset_chunks.json").exists()
+    (tmp_path / "user.json").write_text("{}")
+
+    handler = OutputHandler(handler._config)
+    del handler._config["General"]["WriteOutputDict"]
+    handler.write_output_paths_dict()
+    handler.manifest.save()
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) \
+        == [".servicex_databinder_manifest.json", "user.json"]
@@ -0,0 +1,68 @@
+import logging
+
+import pytest
+
+from servicex_databinder import query_compiler
+from servicex_databinder.query_compiler import QueryCompiler, _key
+from servicex_databinder.request import ServiceXRequest
+
+pytest.importorskip("tcut_to_qastle")
+pytest.importorskip("qastle")
+
+
+def test_memo_and_disk_cache(tmp_path):
+    compiler = QueryCompiler(tmp_path)
+    query = compiler.compile("columns", "nominal", "jet_pt", "jet_pt > 10")
+    assert "jet_pt" in query
+    assert compiler.compile("funcadl", "nominal",
+                            "Select(lambda e: {'pt': e.jet_pt})") \
+        .startswith("(Select (call EventDataset")
+    compiler.compile("columns", "nominal", "jet_pt", "jet_pt > 10")
+    assert compiler.hits == 1
+    compiler.save()
+
+    compiler = QueryCompiler(tmp_path)
+    assert compiler.compile("columns", "nominal", "jet_pt",
+                            "jet_pt > 10") == query
+    assert compiler.hits == 1
+
+
+def test_xaod_funcadl():
+    pytest.importorskip("func_adl_servicex")
+    query = QueryCompiler().compile(
+        "xaod-funcadl",
+        "Select(lambda e: e.Jets()).Select(lambda j: {'pt': j.pt()})"
+        )
+    assert query.startswith("(call Select (call Select (call EventDataset")
+
+
+def test_compile_many_on_process_pool(monkeypatch, caplog):
+    monkeypatch.setattr(query_compiler, "PARALLEL_MIN_QUERIES", 4)
+    specs = [("columns", "nominal", f"jet_pt{i}", "jet_pt0 > 10")
+             for i in range(4)]
+    bad = ("columns", "nominal", "jet_pt0", "jet_pt0 >> ")
+    compiler = QueryCompiler()
+    compiler.compile_many(specs + [bad], workers=2)
+    assert set(compiler._queries) == {_key(*spec) for spec in specs}
+    assert not compiler._memo
+    assert compiler.compile(*specs[0]) == compiler._queries[_key(*specs[0])]
+    assert compiler.hits == 1
+
+    # a query failing on the pool is compiled again (and its error
+    # logged) when the request is built
+    samples = [{"Name": f"sample{i}", "XRootDFiles": "root://eos/a.root",
+                "Tree": "nominal", "Columns": spec[2], "Filter": spec[3],
+                "Type": "uproot", "Transformer": "uproot"}
+               for i, spec in enumerate(specs + [bad])]
+    config = {"General": {"ServiceXName": "uproot", "QueryCache": False},
+              "Sample": samples}
+    monkeypatch.setattr(query_compiler.os, "cpu_count", lambda: 2)
+    request = ServiceXRequest(config)
+    with caplog.at_level(logging.ERROR):
+        requests = request.get_requests()
+    assert [req["query"] is None for req in requests] \
+        == [False] * 4 + [True]
+    # the other queries come from the process pool
+    assert request._compiler.hits == 4
+    assert "Exception occured for the query of Sample sample4" \
+        in caplog.text
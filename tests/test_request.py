@@ -0,0 +1,47 @@
+from servicex_databinder.did_resolver import LocalDIDResolver
+from servicex_databinder.request import ServiceXRequest
+
+
+def _config(sample):
+    sample.update({"Name": "ttH", "Tree": "nominal", "Columns": "jet_pt",
+                   "Type": "uproot", "Transformer": "uproot"})
+    return {"General": {"ServiceXName": "uproot", "QueryCache": False},
+            "Sample": [sample]}
+
+
+def test_shard_xrootd_files():
+    files = [f"root://eos/file{i}.root" for i in range(5)]
+    config = _config({"XRootDFiles": ",".join(files),
+                      "MaxFilesPerRequest": 2})
+    requests = ServiceXRequest(config).get_requests()
+    assert [req["dataset"] for req in requests] \
+        == [files[0:2], files[2:4], files[4:]]
+    assert len({req["query"] for req in requests}) == 1
+
+
+def test_shard_rucio_did():
+    files = [f"root://site/file{i}.root" for i in range(3)]
+    resolver = LocalDIDResolver({"user.kchoi:big": files,
+                                 "user.kchoi:small": files[:1]})
+    config = _config({"RucioDID": "user.kchoi:big, user.kchoi:small",
+                      "MaxFilesPerRequest": 2})
+    requests = ServiceXRequest(config, resolver).get_requests()
+    assert [req["dataset"] for req in requests] \
+        == [files[0:2], files[2:], "user.kchoi:small"]
+
+    # DIDs which cannot be resolved are requested as a whole
+    config = _config({"RucioDID": "user.kchoi:other",
+                      "MaxFilesPerRequest": 2})
+    requests = ServiceXRequest(config, resolver).get_requests()
+    assert [req["dataset"] for req in requests] == ["user.kchoi:other"]
+
+
+def test_deduplicate():
+    config = _config({"XRootDFiles": "root://eos/a.root, root://eos/b.root"})
+    config["Sample"].append(dict(config["Sample"][0], Name="ttH_copy",
+                                 XRootDFiles="root://eos/b.root,"
+                                             "root://eos/a.root"))
+    config["Sample"].append(dict(config["Sample"][0]))
+    requests = ServiceXRequest(config).get_requests()
+    assert len(requests) == 1
+    assert [req["Sample"] for req in requests[0]["fanout"]] == ["ttH_copy"]
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from servicex_databinder import retry
+
+
+class ServiceXException(Exception):
+    pass
+
+
+class FatalError(Exception):
+    pass
+
+
+def _config(policies):
+    return {"General": {"Retry": policies}}
+
+
+def test_retry_policies():
+    policies = retry.retry_policies(_config({"OSError": {"MaxAttempts": 5}}))
+    assert policies["OSError"]["MaxAttempts"] == 5
+    assert policies["OSError"]["Backoff"] == retry.DEFAULT_POLICY["Backoff"]
+    assert "ServiceXException" in policies
+    assert retry.retry_policies(_config(False)) == {}
+    # subclasses follow the policy of their base class
+    assert retry.policy_for(ConnectionError(), policies) \
+        is policies["OSError"]
+    assert retry.policy_for(FatalError(), policies) is None
+
+
+def test_call_with_retry():
+    policies = retry.retry_policies(_config(
+        {"ServiceXException": {"MaxAttempts": 3, "Backoff": 0}}
+        ))
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ServiceXException("(500) Internal Server Error")
+        return "files"
+
+    assert asyncio.run(retry.call_with_retry(flaky, policies)) == "files"
+    assert len(calls) == 3
+
+    calls.clear()
+
+    async def failing():
+        calls.append(1)
+        raise ServiceXException("(503) Service Unavailable")
+
+    with pytest.raises(ServiceXException):
+        asyncio.run(retry.call_with_retry(failing, policies))
+    assert len(calls) == 3
+
+    calls.clear()
+
+    async def fatal():
+        calls.append(1)
+        raise FatalError("transform failed")
+
+    with pytest.raises(FatalError):
+        asyncio.run(retry.call_with_retry(fatal, policies))
+    assert len(calls) == 1
+
+
+def test_is_transient():
+    assert retry.is_transient(TimeoutError())
+    assert retry.is_transient(ConnectionResetError())
+    assert retry.is_transient(ServiceXException("(503) Service Unavailable"))
+    assert retry.is_transient(ServiceXException(
+        "ServiceX rejected the transformation request: (400)bad query"
+        )) is False
+    assert retry.is_transient(ServiceXException(
+        "Failed to transform all files in 1234")) is False
+    try:
+        try:
+            raise ConnectionResetError()
+        except ConnectionResetError as e:
+            raise ServiceXException("lost the backend") from e
+    except ServiceXException as e:
+        assert retry.is_transient(e)
+    assert retry.is_transient(FatalError()) is None
+
+
+def test_permanent_errors_are_not_retried():
+    policies = retry.retry_policies(_config(
+        {"ServiceXException": {"MaxAttempts": 3, "Backoff": 0}}
+        ))
+    for message in ["Failed to transform all files in 1234",
+                    "ServiceX rejected the transformation request: (400)"]:
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            raise ServiceXException(message)
+
+        with pytest.raises(ServiceXException):
+            asyncio.run(retry.call_with_retry(failing, policies))
+        assert len(calls) == 1
+
+
+def test_attempts_are_counted_per_error_class(monkeypatch):
+    monkeypatch.setattr(retry, "backoff_delay", lambda attempt, policy: 0)
+    policies = retry.retry_policies(_config({}))
+    errors = [TimeoutError(), TimeoutError(), ServiceXException("(503)")]
+
+    async def flaky():
+        if errors:
+            raise errors.pop(0)
+        return "files"
+
+    # 3 failures in total, but at most 2 of each class
+    assert asyncio.run(retry.call_with_retry(flaky, policies)) == "files"
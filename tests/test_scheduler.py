@@ -0,0 +1,61 @@
+from servicex_databinder.scheduler import RequestScheduler
+
+
+def _config(policy, priorities={}, **general):
+    return {
+        "General": dict(general, SchedulePolicy=policy),
+        "Sample": [{"Name": name, "Priority": priority}
+                   for name, priority in priorities.items()]
+    }
+
+
+def _requests():
+    return [
+        {"Sample": "Signal", "dataset": [f"root://a/{i}" for i in range(50)]},
+        {"Sample": "Signal", "dataset": [f"root://b/{i}" for i in range(40)]},
+        {"Sample": "Data", "dataset": "data15:data15.DAOD"},
+        {"Sample": "Control", "dataset": ["root://c/0"]},
+    ]
+
+
+def test_sjf():
+    ordered = RequestScheduler(_config("sjf")).order(_requests())
+    assert [len(req["dataset"]) for req in ordered[:3]] == [1, 40, 50]
+    # unknown size (no RucioFileCounts) goes last
+    assert ordered[-1]["Sample"] == "Data"
+
+
+class FakeRucio():
+    def __init__(self):
+        self.calls = []
+
+    def list_files(self, scope, name):
+        self.calls.append(f"{scope}:{name}")
+        return [{}] * 10
+
+
+def test_sjf_rucio_file_counts():
+    scheduler = RequestScheduler(_config("sjf", RucioFileCounts=True))
+    scheduler._rucio = FakeRucio()
+    ordered = [req["Sample"] for req in scheduler.order(_requests())]
+    assert ordered == ["Control", "Data", "Signal", "Signal"]
+    assert scheduler._rucio.calls == ["data15:data15.DAOD"]
+
+    # requests served by the result cache go first without a lookup
+    scheduler = RequestScheduler(_config("sjf", RucioFileCounts=True))
+    scheduler._rucio = FakeRucio()
+    ordered = scheduler.order(_requests(),
+                              lambda req: req["Sample"] == "Data")
+    assert ordered[0]["Sample"] == "Data"
+    assert scheduler._rucio.calls == []
+
+
+def test_priority_and_fair():
+    scheduler = RequestScheduler(_config("fair", {"Data": 1}))
+    ordered = [req["Sample"] for req in scheduler.order(_requests())]
+    assert ordered == ["Data", "Signal", "Control", "Signal"]
+
+
+def test_fifo():
+    requests = _requests()
+    assert RequestScheduler(_config("fifo")).order(requests) == requests